@@ -1,18 +1,17 @@
 import os
-import ray
+import asyncio
 from modal import Image, App, web_endpoint, Secret
 from typing import List
 from chat_forecasting import ForecastingMultiAgents
 from chat_forecasting.caching_agent import *
 from fastapi.responses import StreamingResponse
-from utils import process_request
+from utils import forecasting_search_batch, forecasting_search_batch_ndjson, forecasting_search_batch_ray, BATCH_BACKEND
 from time import time
-from tqdm import tqdm
 from contextlib import asynccontextmanager
 
 app = App("forecasting_agents", secrets=[])
 image = Image.debian_slim().apt_install("git").run_commands(
-    "pip install python-dotenv openai anthropic google-generativeai fireworks-ai dateparser lxml[html_clean] motor ray",
+    "pip install python-dotenv openai anthropic google-generativeai fireworks-ai dateparser lxml[html_clean] motor aiohttp tqdm ray zstandard prometheus_client",
     "pip install git+https://github.com/justinphan3110cais/newspaper4k-forecasting-ai.git",
 )
 
@@ -26,6 +25,8 @@ async def forecasting_search_endpoint(data: dict):
     publisherPrompt = data.get('publisherPrompt')
     search_type = data.get('search_type')
     before_timestamp = data.get('beforeTimestamp')
+    research_deadline_ms = data.get('researchDeadlineMs')
+    min_sources = data.get('minSources')
 
     search_type = "news"
     multi_agents = ForecastingMultiAgents(model,
@@ -33,7 +34,9 @@ async def forecasting_search_endpoint(data: dict):
                                           plannerPrompt, 
                                           publisherPrompt, 
                                           search_type, 
-                                          before_timestamp)
+                                          before_timestamp,
+                                          research_deadline_ms=research_deadline_ms,
+                                          min_sources=min_sources)
 
     response = multi_agents.completions(messages)
 
@@ -50,30 +53,45 @@ async def forecasting_search_endpoint_batch(data: dict, parallel: int=20):
     plannerPrompt = data.get('plannerPrompt')
     publisherPrompt = data.get('publisherPrompt')
     search_type = data.get('search_type')
+    research_deadline_ms = data.get('researchDeadlineMs')
+    min_sources = data.get('minSources')
     search_type = "news"
 
-    env_vars = {k: str(v) for k, v in os.environ.items()}
-    env_vars['RAY_DEDUP_LOGS'] = "0"
-    ray.init(num_cpus=parallel, runtime_env={"env_vars": env_vars})
-    futures = [process_request.options(num_cpus=0.25).remote(q, 
-                                    model=model, 
-                                    breadth=breadth, 
-                                    planner_prompt=plannerPrompt,
-                                    publisher_prompt=publisherPrompt,
-                                    search_type=search_type)
-                                    for q in questions]
-
-    results = []
-    for _ in tqdm(range(len(futures)), desc="Processing"):
-        done, futures = ray.wait(futures)
-        results.extend(ray.get(done))
-
-    ray.shutdown()
+    kwargs = dict(model=model, 
+                  breadth=breadth, 
+                  planner_prompt=plannerPrompt,
+                  publisher_prompt=publisherPrompt,
+                  search_type=search_type,
+                  research_deadline_ms=research_deadline_ms,
+                  min_sources=min_sources)
+
+    if BATCH_BACKEND == "ray":
+        # ray is initialized once per container and reused; ray.wait blocks, keep it off the event loop
+        results = await asyncio.to_thread(forecasting_search_batch_ray, questions, parallel, num_cpus=0.25, **kwargs)
+    else:
+        results = await forecasting_search_batch(questions, parallel, **kwargs)
+
     t1 = time()
     print("Total forecasting_search_batch_endpoint time:", t1-t0,"s")
 
     return results
 
+
+@app.function(image=image, cpu=20, secrets=[Secret.from_name("forecasting-secret")])
+@web_endpoint(method="POST")
+async def forecasting_search_endpoint_batch_stream(data: dict, parallel: int=20):
+    # One NDJSON line ({"index", "elapsed", "result"}) per question, in completion order
+    response = forecasting_search_batch_ndjson(data['questions'], 
+                                               parallel, 
+                                               model=data['model'], 
+                                               breadth=data.get('breadth'), 
+                                               planner_prompt=data.get('plannerPrompt'),
+                                               publisher_prompt=data.get('publisherPrompt'),
+                                               search_type="news",
+                                               research_deadline_ms=data.get('researchDeadlineMs'),
+                                               min_sources=data.get('minSources'))
+    return StreamingResponse(response, media_type='application/x-ndjson')
+
     
 
 async def forecasting_search_local(data: dict) -> str:
@@ -85,6 +103,8 @@ async def forecasting_search_local(data: dict) -> str:
     publisherPrompt = data.get('publisherPrompt')
     search_type = data.get('search_type')
     before_timestamp = data.get('beforeTimestamp')
+    research_deadline_ms = data.get('researchDeadlineMs')
+    min_sources = data.get('minSources')
 
     multi_agents = ForecastingMultiAgents(model, 
                                           breadth, 
@@ -92,7 +112,9 @@ async def forecasting_search_local(data: dict) -> str:
                                           publisherPrompt, 
                                           search_type, 
                                           before_timestamp,
-                                          factorized_prompt)
+                                          factorized_prompt,
+                                          research_deadline_ms,
+                                          min_sources)
 
     response = multi_agents.completions(messages)
     
@@ -0,0 +1,136 @@
+import os
+import json
+import uuid
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
+from utils import iter_forecasting_batch
+from dotenv import load_dotenv
+load_dotenv()
+
+# Each job is a directory holding job.json (questions, settings, status) and an append-only results.jsonl
+BATCH_JOBS_DIR = os.getenv("BATCH_JOBS_DIR", "batch_jobs")
+
+# Jobs being run by this process
+_running_jobs: Dict[str, asyncio.Task] = {}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class BatchJob:
+    """
+    A batch of forecasting questions with durable per-question checkpoints.
+
+    Every finished question is appended to results.jsonl right away, so a job that
+    dies part way through can be resumed and only runs the questions without a result.
+    """
+    def __init__(self, job_id: str, jobs_dir: str = BATCH_JOBS_DIR):
+        self.job_id = job_id
+        self.path = os.path.join(jobs_dir, job_id)
+        self.job_file = os.path.join(self.path, "job.json")
+        self.results_file = os.path.join(self.path, "results.jsonl")
+
+    @classmethod
+    def create(cls, questions: List[Dict], settings: Dict, jobs_dir: str = BATCH_JOBS_DIR) -> "BatchJob":
+        job = cls(uuid.uuid4().hex, jobs_dir)
+        os.makedirs(job.path)
+        job._write_job(dict(job_id=job.job_id, status="created", questions=questions, settings=settings,
+                            created_at=_now(), updated_at=_now(), error=None))
+        return job
+
+    @classmethod
+    def load(cls, job_id: str, jobs_dir: str = BATCH_JOBS_DIR) -> Optional["BatchJob"]:
+        job = cls(job_id, jobs_dir)
+        # job_id comes from the URL; only accept ids that map to an existing job directory
+        if os.path.basename(job_id) != job_id or not os.path.exists(job.job_file):
+            return None
+        return job
+
+    def _read_job(self) -> Dict:
+        with open(self.job_file) as f:
+            return json.load(f)
+
+    def _write_job(self, job: Dict):
+        # Write-then-rename so a crash never leaves a half-written job.json
+        tmp_file = self.job_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_file, self.job_file)
+
+    def _update_job(self, **fields):
+        job = self._read_job()
+        job.update(fields, updated_at=_now())
+        self._write_job(job)
+
+    def _append_result(self, index: int, result: Dict, elapsed: float):
+        with open(self.results_file, "a") as f:
+            f.write(json.dumps(dict(index=index, elapsed=round(elapsed, 3), result=result), default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def iter_checkpoints(self):
+        if not os.path.exists(self.results_file):
+            return
+        with open(self.results_file) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line may be truncated if the process died mid-write; that question is rerun
+                    continue
+
+    def completed_indices(self) -> Set[int]:
+        return {checkpoint['index'] for checkpoint in self.iter_checkpoints()}
+
+    def results(self) -> List[Optional[Dict]]:
+        results = [None] * len(self._read_job()['questions'])
+        for checkpoint in self.iter_checkpoints():
+            results[checkpoint['index']] = checkpoint['result']
+        return results
+
+    def status(self) -> Dict:
+        job = self._read_job()
+        status = job['status']
+        if status == "running" and self.job_id not in _running_jobs:
+            # Marked running on disk but no task in this process: the previous run died
+            status = "interrupted"
+        return dict(job_id=self.job_id, status=status, total=len(job['questions']),
+                    completed=len(self.completed_indices()), created_at=job['created_at'],
+                    updated_at=job['updated_at'], error=job['error'])
+
+    async def run(self, parallel: int = 20):
+        job = self._read_job()
+        completed = self.completed_indices()
+        indices = [i for i in range(len(job['questions'])) if i not in completed]
+        print(f"Batch job {self.job_id}: {len(completed)} questions checkpointed, running {len(indices)}")
+
+        self._update_job(status="running", error=None)
+        try:
+            questions = [job['questions'][i] for i in indices]
+            async for i, result, elapsed in iter_forecasting_batch(questions, parallel, **job['settings']):
+                self._append_result(indices[i], result, elapsed)
+            self._update_job(status="completed")
+        except asyncio.CancelledError:
+            self._update_job(status="cancelled")
+            raise
+        except Exception as e:
+            print(f"Batch job {self.job_id} failed: {e}")
+            self._update_job(status="failed", error=str(e))
+
+
+def start_batch_job(job: BatchJob, parallel: int = 20) -> Dict:
+    """Run (or resume) `job` in the background; a job already running in this process is left alone."""
+    if job.job_id not in _running_jobs:
+        task = asyncio.create_task(job.run(parallel))
+        _running_jobs[job.job_id] = task
+        task.add_done_callback(lambda _: _running_jobs.pop(job.job_id, None))
+    return job.status()
+
+async def cancel_running_jobs():
+    # Called on shutdown; checkpoints are already on disk so these jobs can be resumed later
+    tasks = list(_running_jobs.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
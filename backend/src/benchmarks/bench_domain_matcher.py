@@ -0,0 +1,75 @@
+"""
+Per-URL cost of blacklist and news-domain classification: substring any() over the rule
+lists (the previous implementation) against the compiled DomainMatcher.
+
+    cd backend/src
+    python -m benchmarks.bench_domain_matcher --urls 20000
+
+Also prints how many URLs the two disagree on, with a few examples (substring matching
+flags e.g. "ft" in microsoft.com and "time" in any host containing it).
+"""
+import json
+import random
+import argparse
+from time import perf_counter
+from typing import Callable, Dict, List
+from chat_forecasting.domain_matcher import DomainMatcher, split_host
+from chat_forecasting.news_domains import NEWS_DOMAINS
+from chat_forecasting.research_agent import BLACKLISTED_DOMAINS
+
+OTHER_HOSTS = ["example.com", "microsoft.com", "timeanddate.com", "softwareadvice.com", "gov.uk", "wikipedia.org",
+               "substack.com", "medium.com", "github.com", "arxiv.org", "notyoutube.net", "theobserver.co.za"]
+SUBDOMAINS = ["", "www.", "m.", "edition.", "news.", "uk.", "amp."]
+PATHS = ["/", "/2024/05/14/rates-on-hold", "/world/story-12345?ref=home", "/report.pdf", "/file.ashx?id=3",
+         "/watch?v=abc", "/in/someone", "/section/economy/markets/"]
+
+
+def generate_urls(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    hosts = [f"{name}.com" for name in NEWS_DOMAINS] + ["bbc.co.uk", "abcnews.go.com"] \
+        + [rule for rule in BLACKLISTED_DOMAINS if not rule.startswith(".")] + OTHER_HOSTS
+    return [f"https://{rng.choice(SUBDOMAINS)}{rng.choice(hosts)}{rng.choice(PATHS)}" for _ in range(count)]
+
+def substring_matcher(rules: List[str]) -> Callable[[str], bool]:
+    return lambda url: any(rule in url.lower() for rule in rules)
+
+def bench(name: str, function: Callable[[str], bool], urls: List[str], rounds: int) -> Dict:
+    start = perf_counter()
+    for _ in range(rounds):
+        for url in urls:
+            function(url)
+    elapsed = perf_counter() - start
+    calls = rounds * len(urls)
+    return dict(name=name, calls=calls, us_per_url=elapsed / calls * 1e6)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    urls = generate_urls(args.urls)
+    results, disagreements = [], {}
+    for list_name, rules in [("blacklist", BLACKLISTED_DOMAINS), ("news", NEWS_DOMAINS)]:
+        matcher = DomainMatcher(rules)
+        substring = substring_matcher(rules)
+        compiled = lambda url, matcher=matcher: url in matcher
+        differing = sorted({url for url in urls if substring(url) != compiled(url)})
+        disagreements[list_name] = dict(count=len(differing), examples=differing[:5])
+        results.append(bench(f"{list_name}: substring any()", substring, urls, args.rounds))
+        split_host.cache_clear()
+        results.append(bench(f"{list_name}: DomainMatcher", compiled, urls, args.rounds))
+
+    if args.json:
+        print(json.dumps(dict(results=results, disagreements=disagreements), indent=2))
+        return
+    print(f"{len(urls)} URLs x {args.rounds} rounds")
+    print(f"{'matcher':<30}{'calls':>10}{'us/url':>10}")
+    for r in results:
+        print(f"{r['name']:<30}{r['calls']:>10}{r['us_per_url']:>10.2f}")
+    for list_name, disagreement in disagreements.items():
+        print(f"{list_name}: {disagreement['count']} URLs classified differently, e.g. {disagreement['examples']}")
+
+if __name__ == "__main__":
+    main()
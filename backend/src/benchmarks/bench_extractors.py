@@ -0,0 +1,116 @@
+"""
+Success rate and latency of each article extractor on a saved HTML corpus.
+
+    cd backend/src
+    python -m benchmarks.bench_extractors                      # bundled corpus
+    python -m benchmarks.bench_extractors --save urls.txt      # download pages into the corpus first
+
+The corpus is a directory of HTML files plus an index.jsonl of {"file", "url", "date"?} lines; pages with
+an expected "date" (DATE_FORMAT) are checked, and extractors that get it wrong are listed.
+The bundled corpus holds real pages as saved from the sites (news articles in English, Japanese and
+Chinese, and a front page that is not an article), with the publish dates the sites give.
+"""
+import os
+import json
+import asyncio
+import hashlib
+import argparse
+from time import perf_counter
+from typing import Dict, List
+from chat_forecasting.extractors import EXTRACTORS, ARTICLE_EXTRACTORS, extract_article
+from chat_forecasting.parse_date import UNKNOWN_TIME
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+
+
+def load_corpus(corpus_dir: str) -> List[Dict]:
+    pages = []
+    with open(os.path.join(corpus_dir, "index.jsonl")) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                with open(os.path.join(corpus_dir, entry['file']), encoding="utf-8", errors="replace") as page:
+                    pages.append(dict(url=entry['url'], file=entry['file'], html=page.read(), expected_date=entry.get('date')))
+    return pages
+
+async def save_corpus(urls: List[str], corpus_dir: str):
+    from chat_forecasting.crawl_agent import download_html
+    from chat_forecasting.http_client import close_http_session
+
+    os.makedirs(corpus_dir, exist_ok=True)
+    with open(os.path.join(corpus_dir, "index.jsonl"), "a") as index:
+        for url in urls:
+            try:
+                html = await download_html(url)
+            except Exception as e:
+                print(f"Failed to download {url}: {e}")
+                continue
+            name = hashlib.sha1(url.encode()).hexdigest()[:16] + ".html"
+            with open(os.path.join(corpus_dir, name), "w", encoding="utf-8") as f:
+                f.write(html)
+            index.write(json.dumps(dict(file=name, url=url)) + "\n")
+    await close_http_session()
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+def bench(name: str, extract, pages: List[Dict], repeat: int) -> Dict:
+    latencies, succeeded, dated, words, wrong_dates = [], 0, 0, 0, []
+    for page in pages:
+        for i in range(repeat):
+            start = perf_counter()
+            try:
+                result = extract(page['url'], page['html'])
+            except Exception:
+                result = None
+            latencies.append((perf_counter() - start) * 1000)
+        if result is not None and result['raw_content'].strip():
+            succeeded += 1
+            dated += result['date'] != UNKNOWN_TIME
+            words += len(result['raw_content'].split())
+        if page['expected_date'] and (result is None or result['date'] != page['expected_date']):
+            wrong_dates.append(dict(file=page['file'], expected=page['expected_date'], got=result['date'] if result else None))
+    return dict(
+        extractor=name,
+        pages=len(pages),
+        success_rate=succeeded / len(pages),
+        date_rate=dated / len(pages),
+        date_accuracy=1 - len(wrong_dates) / max(sum(1 for page in pages if page['expected_date']), 1),
+        wrong_dates=wrong_dates,
+        avg_words=words / max(succeeded, 1),
+        mean_ms=sum(latencies) / len(latencies),
+        p50_ms=percentile(latencies, 50),
+        p95_ms=percentile(latencies, 95),
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS_DIR)
+    parser.add_argument("--repeat", type=int, default=20, help="extractions per page")
+    parser.add_argument("--save", help="file with one URL per line to download into the corpus before benchmarking")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    if args.save:
+        with open(args.save) as f:
+            asyncio.run(save_corpus([line.strip() for line in f if line.strip()], args.corpus))
+
+    pages = load_corpus(args.corpus)
+    candidates = {name: EXTRACTORS[name] for name in EXTRACTORS}
+    candidates["chain(" + ",".join(ARTICLE_EXTRACTORS) + ")"] = extract_article
+    results = [bench(name, extract, pages, args.repeat) for name, extract in candidates.items()]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'extractor':<24}{'pages':>7}{'success':>9}{'dated':>8}{'date ok':>9}{'words':>8}{'mean ms':>10}{'p50 ms':>9}{'p95 ms':>9}")
+    for r in results:
+        print(f"{r['extractor']:<24}{r['pages']:>7}{r['success_rate']:>9.0%}{r['date_rate']:>8.0%}{r['date_accuracy']:>9.0%}{r['avg_words']:>8.0f}"
+              f"{r['mean_ms']:>10.2f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}")
+    for r in results:
+        for wrong in r['wrong_dates']:
+            print(f"{r['extractor']}: {wrong['file']} dated {wrong['got']}, expected {wrong['expected']}")
+
+if __name__ == "__main__":
+    main()
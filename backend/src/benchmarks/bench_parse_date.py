@@ -0,0 +1,78 @@
+"""
+Throughput of parse_date on publish-date strings as they appear in meta tags, feeds and bylines.
+
+    cd backend/src
+    python -m benchmarks.bench_parse_date
+
+Compares the previous parse_date (dateparser first), the layered parser without its memo,
+and with a warm memo (of absolute dates; relative ones always go to dateparser); also validate_time's strptime against the memoized date_from_str.
+"""
+import os
+import json
+import argparse
+from time import perf_counter
+from typing import Callable, Dict, List
+import dateparser
+from datetime import datetime
+from chat_forecasting.parse_date import DATE_FORMAT, UNKNOWN_TIME, parse_date, date_from_str
+
+DATES_FILE = os.path.join(os.path.dirname(__file__), "data", "publish_dates.txt")
+
+
+def previous_parse_date(date_str: str) -> str:
+    # parse_date before the fast paths: dateparser first, then YYYYMMDD / ISO
+    parsed_date = dateparser.parse(date_str, settings={'STRICT_PARSING': False})
+    if not parsed_date:
+        try:
+            if len(date_str) == 8 and date_str.isdigit():
+                parsed_date = datetime.strptime(date_str, "%Y%m%d")
+            elif 'T' in date_str:
+                parsed_date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+        except ValueError:
+            return UNKNOWN_TIME
+    return parsed_date.strftime(DATE_FORMAT) if parsed_date else UNKNOWN_TIME
+
+def bench(name: str, function: Callable, inputs: List[str], rounds: int) -> Dict:
+    start = perf_counter()
+    for _ in range(rounds):
+        for value in inputs:
+            function(value)
+    elapsed = perf_counter() - start
+    calls = rounds * len(inputs)
+    return dict(name=name, calls=calls, us_per_call=elapsed / calls * 1e6, calls_per_second=calls / elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dates", default=DATES_FILE, help="file with one date string per line")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    with open(args.dates) as f:
+        dates = [line.strip() for line in f if line.strip()]
+
+    # Parsers must agree before speed matters (relative dates like "3 hours ago" depend on the clock)
+    mismatches = [(d, previous_parse_date(d), parse_date(d)) for d in dates if previous_parse_date(d) != parse_date(d)]
+    for date_str, expected, actual in mismatches:
+        print(f"Mismatch for {date_str!r}: previous={expected} parse_date={actual}")
+
+    formatted = [parse_date(d) for d in dates if parse_date(d) != UNKNOWN_TIME]
+    previous_parse_date(dates[0])  # import/locale loading is not part of the per-call cost
+    results = [
+        bench("previous parse_date", previous_parse_date, dates, args.rounds),
+        bench("parse_date (no memo)", lambda d: parse_date(d, memo=False), dates, args.rounds),
+        bench("parse_date (warm memo)", parse_date, dates, args.rounds),
+        bench("validate_time strptime", lambda d: datetime.strptime(d, DATE_FORMAT), formatted, args.rounds),
+        bench("validate_time memo", date_from_str, formatted, args.rounds),
+    ]
+
+    if args.json:
+        print(json.dumps(dict(mismatches=len(mismatches), results=results), indent=2))
+        return
+    print(f"{len(dates)} date strings, {len(mismatches)} mismatches")
+    print(f"{'parser':<26}{'calls':>8}{'us/call':>10}{'calls/s':>12}")
+    for r in results:
+        print(f"{r['name']:<26}{r['calls']:>8}{r['us_per_call']:>10.1f}{r['calls_per_second']:>12.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+"""
+End-to-end load test of fast_api.py against local stand-ins for Serper, the OpenAI API and news sites.
+
+    cd backend/src
+    python -m benchmarks.load_test --ramp 1,4,16 --stage-seconds 30
+    python -m benchmarks.load_test --endpoint batch --batch-size 10 --ramp 1,2 --json-out load.json
+
+Starts the three fake services in a child process and a uvicorn `fast_api:app` pointed at them
+(SERPER_API_URL, OPENAI_BASE_URL, CACHE_BACKEND=memory), then drives /forecasting_search/ and/or
+/forecasting_search_batch/ at each concurrency of the ramp for a fixed time. Every fake takes a
+latency distribution and an error rate:
+
+    const:MS | uniform:LO_MS:HI_MS | lognormal:MEDIAN_MS:SIGMA        e.g. --llm-latency lognormal:800:0.4
+    RATE[:STATUS]                                                     e.g. --serper-errors 0.02:429
+
+The fake LLM streams --llm-tokens tokens --llm-token-ms apart after its latency. With --target the
+harness loads an already running server instead (its upstreams are whatever it is configured with).
+
+Per stage it reports p50/p95/p99 of time to first byte, time to [FORECASTING_START] (single endpoint)
+and total latency, throughput, errors and the server's peak RSS including its worker processes.
+Questions are read from a JSONL file of {"question", "beforeTimeStamp"?} objects; --cold makes every
+request's question unique so no search or source cache is hit.
+"""
+import os
+import sys
+import json
+import math
+import random
+import socket
+import logging
+import asyncio
+import hashlib
+import argparse
+import subprocess
+import multiprocessing
+from time import time, perf_counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import aiohttp
+import numpy as np
+from aiohttp import web
+
+QUESTIONS_FILE = os.path.join(os.path.dirname(__file__), "data", "questions.jsonl")
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = ("the officials said on tuesday that inflation rates markets policy growth forecast analysts expect "
+         "government report quarter central bank decision election results according to data showed a sharp "
+         "increase decline investors economy agreement talks negotiations company shares prices").split()
+
+
+# ========================= fake services =========================
+class Latency:
+    """A latency distribution parsed from "const:MS", "uniform:LO:HI" or "lognormal:MEDIAN:SIGMA"."""
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, *params = spec.split(":")
+        params = [float(p) for p in params]
+        if kind == "const" and len(params) == 1:
+            self._sample = lambda: params[0]
+        elif kind == "uniform" and len(params) == 2:
+            self._sample = lambda: random.uniform(*params)
+        elif kind == "lognormal" and len(params) == 2:
+            self._sample = lambda: random.lognormvariate(math.log(params[0]), params[1])
+        else:
+            raise ValueError(f"Unknown latency distribution {spec}")
+
+    def sample(self) -> float:
+        """A latency in seconds."""
+        return max(self._sample(), 0) / 1000
+
+def parse_errors(spec: str):
+    rate, _, status = spec.partition(":")
+    return float(rate), int(status or 500)
+
+def fault_middleware(latency: Latency, error_rate: float, error_status: int):
+    @web.middleware
+    async def middleware(request, handler):
+        await asyncio.sleep(latency.sample())
+        if random.random() < error_rate:
+            headers = {"Retry-After": "1"} if error_status == 429 else None
+            return web.json_response(dict(error="injected by load_test"), status=error_status, headers=headers)
+        return await handler(request)
+    return middleware
+
+def _seed(text: str) -> int:
+    return int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def serper_app(args) -> web.Application:
+    """POST /news and /search with a batch of {"q"} queries, like google.serper.dev."""
+    latency, (error_rate, error_status) = Latency(args.serper_latency), parse_errors(args.serper_errors)
+    app = web.Application(middlewares=[fault_middleware(latency, error_rate, error_status)])
+
+    def _results(query: str) -> List[Dict]:
+        rng = random.Random(_seed(query))
+        # Articles are dated before the query's "before:" operator so they pass the date check
+        before = query.split("before:")[-1].strip() if "before:" in query else None
+        results = []
+        for n in range(args.results_per_query):
+            host = f"127.0.0.{rng.randint(1, args.news_hosts)}:{args.news_port}"
+            link = f"http://{host}/article/{_seed(query) % 100000}-{n}" + (f"?before={before}" if before else "")
+            results.append(dict(title=_text(rng, 8).capitalize(), link=link, snippet=_text(rng, 30),
+                                date=f"{n + 1} days ago", source=f"News {host}", position=n + 1))
+        return results
+
+    async def search(request):
+        key = "news" if request.match_info['search_type'] == "news" else "organic"
+        queries = await request.json()
+        return web.json_response([{"searchParameters": dict(q=q['q']), key: _results(q['q'])} for q in queries])
+
+    app.router.add_post("/{search_type}", search)
+    return app
+
+def news_app(args) -> web.Application:
+    """Article pages on every 127.0.0.x host with a publish date, a title and --article-words of text."""
+    latency, (error_rate, error_status) = Latency(args.news_latency), parse_errors(args.news_errors)
+    app = web.Application(middlewares=[fault_middleware(latency, error_rate, error_status)])
+
+    async def article(request):
+        rng = random.Random(_seed(request.path_qs))
+        before = request.query.get('before')
+        published = (datetime.strptime(before, "%Y-%m-%d") if before else datetime.now()) - timedelta(days=rng.randint(1, 20))
+        paragraphs = "".join(f"<p>{_text(rng, 60).capitalize()}.</p>" for _ in range(max(args.article_words // 60, 1)))
+        body = (f"<html><head><title>{_text(rng, 8)}</title><link rel=\"icon\" href=\"/favicon.ico\">"
+                f"<meta property=\"article:published_time\" content=\"{published.isoformat()}\"></head>"
+                f"<body><nav><a href=\"/\">Home</a></nav><article><h1>{_text(rng, 8)}</h1>{paragraphs}</article></body></html>")
+        return web.Response(text=body, content_type="text/html")
+
+    app.router.add_get("/{path:.*}", article)
+    return app
+
+def openai_app(args) -> web.Application:
+    """POST /v1/chat/completions, streamed (publisher) or not (planner, summarizer)."""
+    latency, (error_rate, error_status) = Latency(args.llm_latency), parse_errors(args.llm_errors)
+    app = web.Application(middlewares=[fault_middleware(latency, error_rate, error_status)])
+
+    def _answer(prompt: str) -> str:
+        rng = random.Random(_seed(prompt))
+        if "make the following article shorter" in prompt:
+            return _text(rng, 120)
+        if "search engine queries" in prompt:
+            question = prompt.split("forecasting question:")[-1].split("\n")[0].split()
+            return "\n".join(f"{i}. {'News' if i % 2 else 'Opinion'} {' '.join(rng.sample(question, min(len(question), 6)))}"
+                             for i in range(1, 11))
+        return f"<facts>{_text(rng, args.llm_tokens)}</facts>\n<answer>{rng.randint(1, 99) / 100}</answer>"
+
+    def _chunk(body: Dict, **fields) -> Dict:
+        return dict(id="chatcmpl-load-test", created=int(time()), model=body.get('model', "fake"), **fields)
+
+    async def completions(request):
+        body = await request.json()
+        answer = _answer(body['messages'][-1]['content'])
+        if not body.get('stream'):
+            return web.json_response(_chunk(body, object="chat.completion",
+                                            choices=[dict(index=0, message=dict(role="assistant", content=answer), finish_reason="stop")],
+                                            usage=dict(prompt_tokens=0, completion_tokens=0, total_tokens=0)))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        tokens = answer.split(" ")
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(args.llm_token_ms / 1000)
+            delta = dict(content=token if i == 0 else " " + token)
+            chunk = _chunk(body, object="chat.completion.chunk", choices=[dict(index=0, delta=delta, finish_reason=None)])
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        chunk = _chunk(body, object="chat.completion.chunk", choices=[dict(index=0, delta={}, finish_reason="stop")])
+        await response.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode())
+        await response.write_eof()
+        return response
+
+    app.router.add_post("/v1/chat/completions", completions)
+    return app
+
+def serve_fakes(args, ready):
+    """Child process entrypoint: run the fake services until terminated."""
+    # Hedged and raced requests are cancelled mid-flight by design; don't log each dropped connection
+    logging.getLogger("aiohttp.server").setLevel(logging.CRITICAL)
+
+    async def _serve():
+        runners = []
+        # News sites listen on all interfaces so every 127.0.0.x is a distinct host
+        for app, host, port in [(serper_app(args), "127.0.0.1", args.serper_port),
+                                (openai_app(args), "127.0.0.1", args.openai_port),
+                                (news_app(args), "0.0.0.0", args.news_port)]:
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, host, port, backlog=4096).start()
+            runners.append(runner)
+        ready.set()
+        await asyncio.Event().wait()
+    asyncio.run(_serve())
+
+
+# ========================= server under test =========================
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(args, port: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "SERPER_API_URL": f"http://127.0.0.1:{args.serper_port}",
+        "SERPER_API_KEY": "load-test",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+        "OPENAI_API_KEY": "load-test",
+        "CACHE_BACKEND": "memory",
+        "CASSETTE_MODE": "off",
+        "HTML_STORE_DIR": "",
+        "NO_PROXY": "127.0.0.1,localhost",
+    }
+    log = open(args.server_log, "a") if args.server_log else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "fast_api:app", "--host", "127.0.0.1", "--port", str(port),
+                             "--log-level", "warning"], cwd=SRC_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+async def wait_until_up(target: str, process: Optional[subprocess.Popen], timeout: float = 120):
+    deadline = time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}, see --server-log")
+            try:
+                async with session.get(f"{target}/openapi.json") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"Server at {target} did not come up within {timeout}s")
+
+def process_tree_rss(pid: int) -> int:
+    """Resident set size in bytes of `pid` and all of its descendants (e.g. the fetch pool workers)."""
+    children: Dict[int, List[int]] = {}
+    rss: Dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields after it are space separated
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, []))
+    return total
+
+
+# ========================= load generator =========================
+def load_questions(path: str) -> List[Dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class Stage:
+    def __init__(self, endpoint: str, concurrency: int):
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.samples: List[Dict] = []
+        self.peak_rss = 0
+
+    def report(self, elapsed: float) -> Dict:
+        ok = [s for s in self.samples if s['ok']]
+
+        def _percentiles(key):
+            values = [s[key] for s in ok if s[key] is not None]
+            if not values:
+                return None
+            return {f"p{q}": round(float(np.percentile(values, q)), 3) for q in (50, 95, 99)}
+
+        return dict(endpoint=self.endpoint, concurrency=self.concurrency, requests=len(self.samples),
+                    errors=len(self.samples) - len(ok), elapsed=round(elapsed, 2),
+                    throughput=round(len(ok) / elapsed, 3) if elapsed else None,
+                    questions_per_second=round(sum(s['questions'] for s in ok) / elapsed, 3) if elapsed else None,
+                    ttfb=_percentiles('ttfb'), forecasting_start=_percentiles('forecasting_start'), total=_percentiles('total'),
+                    peak_rss_mb=round(self.peak_rss / 2**20, 1) if self.peak_rss else None,
+                    error_examples=sorted({s['error'] for s in self.samples if s['error']})[:5])
+
+class LoadGenerator:
+    def __init__(self, args, target: str, questions: List[Dict]):
+        self.args = args
+        self.target = target.rstrip("/")
+        self.questions = questions
+        self.sent = 0
+        self.run_id = f"{int(time())}"
+
+    def _next_questions(self, count: int) -> List[Dict]:
+        picked = []
+        for _ in range(count):
+            example = dict(self.questions[self.sent % len(self.questions)])
+            if self.args.cold:
+                example['question'] = f"{example['question']} (load test {self.run_id}-{self.sent})"
+            self.sent += 1
+            picked.append(example)
+        return picked
+
+    def _payload(self, endpoint: str):
+        if endpoint == "single":
+            example = self._next_questions(1)[0]
+            payload = dict(model=self.args.model, breadth=self.args.breadth, messages=[dict(role="user", content=example['question'])])
+            if example.get('beforeTimeStamp'):
+                payload['beforeTimestamp'] = example['beforeTimeStamp']
+            return "/forecasting_search/", payload, 1
+        questions = self._next_questions(self.args.batch_size)
+        payload = dict(model=self.args.model, breadth=self.args.breadth, questions=questions)
+        return f"/forecasting_search_batch/?parallel={self.args.batch_parallel}", payload, len(questions)
+
+    async def request(self, session: aiohttp.ClientSession, endpoint: str) -> Dict:
+        path, payload, questions = self._payload(endpoint)
+        sample = dict(ok=False, ttfb=None, forecasting_start=None, total=None, questions=questions, error=None)
+        start = perf_counter()
+        try:
+            async with session.post(self.target + path, json=payload) as response:
+                body, tail = [], ""
+                async for chunk in response.content.iter_any():
+                    if sample['ttfb'] is None:
+                        sample['ttfb'] = perf_counter() - start
+                    text = chunk.decode(errors="replace")
+                    body.append(text)
+                    # The marker may be split across chunks
+                    if sample['forecasting_start'] is None and "[FORECASTING_START]" in tail + text:
+                        sample['forecasting_start'] = perf_counter() - start
+                    tail = (tail + text)[-32:]
+                sample['total'] = perf_counter() - start
+                body = "".join(body)
+                if response.status != 200:
+                    sample['error'] = f"HTTP {response.status}"
+                elif endpoint == "single" and "[FORECASTING_END]" not in body:
+                    sample['error'] = "stream ended without [FORECASTING_END]"
+                elif endpoint == "batch" and not all(r.get('prediction') is not None for r in json.loads(body)):
+                    sample['error'] = "batch result without a prediction"
+                else:
+                    sample['ok'] = True
+        except Exception as e:
+            sample['total'] = perf_counter() - start
+            sample['error'] = f"{type(e).__name__}: {e}"
+        return sample
+
+    async def run_stage(self, stage: Stage, server_pid: Optional[int]) -> Dict:
+        stop_at = perf_counter() + self.args.stage_seconds
+        timeout = aiohttp.ClientTimeout(total=self.args.request_timeout)
+        connector = aiohttp.TCPConnector(limit=0)
+
+        async def _worker(session):
+            while perf_counter() < stop_at:
+                stage.samples.append(await self.request(session, stage.endpoint))
+
+        async def _sample_rss():
+            while True:
+                stage.peak_rss = max(stage.peak_rss, process_tree_rss(server_pid))
+                await asyncio.sleep(0.5)
+
+        rss_task = asyncio.create_task(_sample_rss()) if server_pid else None
+        start = perf_counter()
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            # Requests started before the end of the stage are allowed to finish
+            await asyncio.gather(*[_worker(session) for _ in range(stage.concurrency)])
+        elapsed = perf_counter() - start
+        if rss_task is not None:
+            rss_task.cancel()
+        return stage.report(elapsed)
+
+
+# ========================= report =========================
+def _fmt(percentiles: Optional[Dict]) -> str:
+    if not percentiles:
+        return f"{'-':>23}"
+    return f"{percentiles['p50']:>7.2f}{percentiles['p95']:>8.2f}{percentiles['p99']:>8.2f}"
+
+def print_report(reports: List[Dict]):
+    print(f"\n{'':<37} {'ttfb (s)':^23} {'forecasting_start (s)':^23} {'total (s)':^23}")
+    print(f"{'endpoint':<10}{'conc':>5}{'reqs':>7}{'errs':>7}{'req/s':>8} "
+          + " ".join([f"{'p50':>7}{'p95':>8}{'p99':>8}"] * 3) + f"{'rss MB':>9}")
+    for r in reports:
+        rss = f"{r['peak_rss_mb']:>9.1f}" if r['peak_rss_mb'] else f"{'-':>9}"
+        print(f"{r['endpoint']:<10}{r['concurrency']:>5}{r['requests']:>7}{r['errors']:>7}{r['throughput'] or 0:>8.2f} "
+              f"{_fmt(r['ttfb'])} {_fmt(r['forecasting_start'])} {_fmt(r['total'])}{rss}")
+    for r in reports:
+        for error in r['error_examples']:
+            print(f"{r['endpoint']} x{r['concurrency']} error: {error}")
+
+
+async def run(args):
+    questions = load_questions(args.questions)
+    fakes, server = None, None
+    try:
+        if args.target:
+            target, server_pid = args.target, args.server_pid
+        else:
+            ready = multiprocessing.get_context("spawn").Event()
+            fakes = multiprocessing.get_context("spawn").Process(target=serve_fakes, args=(args, ready), daemon=True)
+            fakes.start()
+            if not await asyncio.to_thread(ready.wait, 30):
+                raise RuntimeError("Fake services did not start")
+            port = args.port or free_port()
+            server = start_server(args, port)
+            target, server_pid = f"http://127.0.0.1:{port}", server.pid
+        await wait_until_up(target, server)
+        print(f"Loading {target} with {len(questions)} questions")
+
+        generator = LoadGenerator(args, target, questions)
+        endpoints = ["single", "batch"] if args.endpoint == "both" else [args.endpoint]
+        reports = []
+        for endpoint in endpoints:
+            for concurrency in args.ramp:
+                report = await generator.run_stage(Stage(endpoint, concurrency), server_pid)
+                print(f"{endpoint} x{concurrency}: {report['requests']} requests, {report['errors']} errors, "
+                      f"{report['throughput']} req/s, total={report['total']}")
+                reports.append(report)
+        return reports
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if fakes is not None:
+            fakes.terminate()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", default=QUESTIONS_FILE, help="JSONL file of {\"question\", \"beforeTimeStamp\"?}")
+    parser.add_argument("--endpoint", choices=["single", "batch", "both"], default="single")
+    parser.add_argument("--ramp", type=lambda s: [int(c) for c in s.split(",")], default=[1, 4, 16],
+                        help="comma separated concurrency of each stage")
+    parser.add_argument("--stage-seconds", type=float, default=30, help="new requests are started for this long per stage")
+    parser.add_argument("--request-timeout", type=float, default=300)
+    parser.add_argument("--cold", action="store_true", help="make every question unique so caches are never hit")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--breadth", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=10, help="questions per /forecasting_search_batch/ request")
+    parser.add_argument("--batch-parallel", type=int, default=20)
+    parser.add_argument("--target", help="URL of an already running server to load instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="with --target, the server's pid for RSS sampling")
+    parser.add_argument("--port", type=int, help="port of the started server (default: a free one)")
+    parser.add_argument("--server-log", help="append the started server's output to this file")
+    parser.add_argument("--serper-latency", default="lognormal:400:0.3")
+    parser.add_argument("--serper-errors", default="0")
+    parser.add_argument("--llm-latency", default="lognormal:600:0.4", help="time to the first token")
+    parser.add_argument("--llm-errors", default="0")
+    parser.add_argument("--llm-tokens", type=int, default=300, help="length of the fake publisher answer")
+    parser.add_argument("--llm-token-ms", type=float, default=10)
+    parser.add_argument("--news-latency", default="lognormal:300:0.6")
+    parser.add_argument("--news-errors", default="0.05")
+    parser.add_argument("--news-hosts", type=int, default=20, help="number of distinct 127.0.0.x news hosts")
+    parser.add_argument("--results-per-query", type=int, default=10)
+    parser.add_argument("--article-words", type=int, default=600)
+    parser.add_argument("--json-out", help="also write the report (and settings) to this JSON file")
+    args = parser.parse_args()
+
+    # Validate the fake settings before anything is started
+    for spec in (args.serper_latency, args.llm_latency, args.news_latency):
+        Latency(spec)
+    args.serper_port, args.openai_port, args.news_port = free_port(), free_port(), free_port()
+
+    reports = asyncio.run(run(args))
+    print_report(reports)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(dict(settings=vars(args), stages=reports), f, indent=2)
+
+if __name__ == "__main__":
+    main()
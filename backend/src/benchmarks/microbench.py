@@ -0,0 +1,156 @@
+"""
+Offline microbenchmarks of the pure-CPU helpers that run on every request, on fixed corpora,
+compared against a saved JSON baseline.
+
+    cd backend/src
+    python -m benchmarks.microbench                        # compare with benchmarks/baselines/microbench.json
+    python -m benchmarks.microbench --save-baseline        # record a new baseline on this machine
+    python -m benchmarks.microbench --case parse_date --max-slowdown 0.5
+
+Inputs: benchmarks/data/microbench.json (Serper results, planner output, research results and a full
+forecasting stream), benchmarks/data/publish_dates.txt and the HTML pages in benchmarks/corpus.
+Each case is timed in several rounds of at least --min-round-ms; the fastest round is the reported
+us/call. Exits with status 1 when a case is more than --max-slowdown slower than its baseline.
+Baselines are machine specific: record one on the machine you compare on.
+
+For wider studies see bench_extractors, bench_parse_date and bench_domain_matcher.
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+from chat_forecasting.crawl_agent import deduplicate_search_links, validate_time
+from chat_forecasting.extractors import extract_favicon
+from chat_forecasting.parse_date import UNKNOWN_TIME, parse_date, extract_date, date_from_str
+from chat_forecasting.research_agent import ResearchAgent
+from chat_forecasting.ForecastingMultiAgents import ForecastingMultiAgents
+from utils import process_forecasting
+from benchmarks.bench_extractors import CORPUS_DIR, load_corpus
+from benchmarks.bench_parse_date import DATES_FILE
+
+DATA_FILE = os.path.join(os.path.dirname(__file__), "data", "microbench.json")
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines", "microbench.json")
+# 2024-07-01: most corpus dates are before it, a few are not
+BEFORE_TIMESTAMP = 1719792000
+
+
+def build_cases() -> List[Tuple[str, Callable, List[tuple]]]:
+    """(name, function, argument tuples); one call is `function(*args)` for every tuple."""
+    with open(DATA_FILE) as f:
+        data = json.load(f)
+    with open(DATES_FILE) as f:
+        dates = [line.strip() for line in f if line.strip()]
+    pages = load_corpus(CORPUS_DIR)
+    formatted_dates = [d for d in map(parse_date, dates) if d != UNKNOWN_TIME]
+
+    # Helpers that do not use their instance are timed unbound, so no API clients are constructed
+    return [
+        ("deduplicate_search_links", deduplicate_search_links, [(data['search_results'],)]),
+        ("_post_process_search", ResearchAgent._post_process_search, [(None, results) for results in data['search_results']]),
+        ("extract_favicon", extract_favicon, [(page['html'], page['url']) for page in pages]),
+        ("parse_date (no memo)", parse_date, [(d, False) for d in dates]),
+        ("extract_date", extract_date, [(page['html'],) for page in pages]),
+        ("date_from_str (no memo)", date_from_str.__wrapped__, [(d,) for d in formatted_dates]),
+        ("validate_time", validate_time, [(BEFORE_TIMESTAMP, d) for d in formatted_dates + [UNKNOWN_TIME]]),
+        ("extract_queries", ForecastingMultiAgents.extract_queries, [(None, data['planner_response'])]),
+        ("format_research_results", ForecastingMultiAgents.format_research_results, [(None, data['research_results'])]),
+        ("process_forecasting", process_forecasting, [(data['forecasting_output'],)]),
+    ]
+
+def time_case(function: Callable, inputs: List[tuple], rounds: int, min_round_ms: float) -> Dict:
+    def _round(number):
+        start = perf_counter()
+        for _ in range(number):
+            for args in inputs:
+                function(*args)
+        return perf_counter() - start
+
+    # Calibrate the inner loop so a round is long enough for the clock (and warms any memo)
+    number = 1
+    while _round(number) * 1000 < min_round_ms:
+        number *= 2
+    calls = number * len(inputs)
+    samples = [_round(number) / calls * 1e6 for _ in range(rounds)]
+    return dict(us_per_call=round(min(samples), 4), median_us=round(median(samples), 4), calls_per_round=calls)
+
+def run(case_filter: str, rounds: int, min_round_ms: float) -> Dict[str, Dict]:
+    results = {}
+    for name, function, inputs in build_cases():
+        if case_filter and case_filter not in name:
+            continue
+        results[name] = time_case(function, inputs, rounds, min_round_ms)
+    return results
+
+def machine_info() -> Dict:
+    return dict(python=platform.python_version(), implementation=platform.python_implementation(),
+                machine=platform.machine(), processor=platform.processor(), system=platform.system())
+
+def compare(results: Dict[str, Dict], baseline: Dict, max_slowdown: float) -> List[str]:
+    """Print current against baseline us/call and return the names of the cases that regressed."""
+    regressions = []
+    print(f"{'case':<28}{'baseline us':>13}{'current us':>13}{'change':>9}")
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f"{name:<28}{'-':>13}{result['us_per_call']:>13.2f}{'new':>9}")
+            continue
+        change = result['us_per_call'] / base['us_per_call'] - 1
+        flag = ""
+        if change > max_slowdown:
+            flag = "  SLOWER"
+            regressions.append(name)
+        elif change < -max_slowdown:
+            flag = "  faster"
+        print(f"{name:<28}{base['us_per_call']:>13.2f}{result['us_per_call']:>13.2f}{change:>+9.1%}{flag}")
+    if baseline.get('machine') != machine_info():
+        print(f"Note: the baseline was recorded on a different machine/Python: {baseline.get('machine')}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--case", default="", help="only run cases whose name contains this")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--min-round-ms", type=float, default=50)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to --baseline instead of comparing")
+    parser.add_argument("--max-slowdown", type=float, default=0.25, help="relative slowdown that counts as a regression")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.case, args.rounds, args.min_round_ms)
+    report = dict(created=datetime.now().isoformat(timespec="seconds"), machine=machine_info(), results=results)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        if args.case and os.path.exists(args.baseline):
+            # A partial run only replaces its own cases
+            with open(args.baseline) as f:
+                report['results'] = {**json.load(f)['results'], **results}
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Saved {len(results)} cases to {args.baseline}")
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    if args.save_baseline or not os.path.exists(args.baseline):
+        print(f"{'case':<28}{'us/call':>10}{'median us':>11}{'calls/round':>13}")
+        for name, result in results.items():
+            print(f"{name:<28}{result['us_per_call']:>10.2f}{result['median_us']:>11.2f}{result['calls_per_round']:>13}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.max_slowdown)
+    if regressions:
+        print(f"{len(regressions)} case(s) more than {args.max_slowdown:.0%} slower than the baseline: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,14 @@ from chat_forecasting.related_forecast_agent import RelatedForecastAgent
 
 from chat_forecasting.prompts import PLANNER_PROMPT, PUBLISHER_PROMPT
 from chat_forecasting.parse_date import GOOGLE_SEARCH_DATE_FORMAT
+from chat_forecasting.cassette import cassette_today
+from chat_forecasting.telemetry import trace, span, REQUESTS_IN_PROGRESS, PUBLISHER_FIRST_TOKEN_SECONDS
 import asyncio
 import os
 import json
 from datetime import datetime
+from time import perf_counter
+from contextlib import aclosing
 from dotenv import load_dotenv
 load_dotenv()
 ENV_TYPE = os.getenv('ENV_TYPE')
@@ -21,12 +25,15 @@ class ForecastingMultiAgents:
                  publisher_prompt: str =None, 
                  search_type: str='news', 
                  before_timestamp: int = None,
-                 factorize_prompt: str=None):
+                 factorize_prompt: str=None,
+                 research_deadline_ms: int = None,
+                 min_sources: int = None):
         serper_api_key = os.getenv("SERPER_API_KEY")
         
         # query -> plannerAgent -> search queries -> researchAgent based on search queries -> concatenated markdown text -> publisherAgnet
-        self.plannerAgent = get_llm_agent_class(model)(model=model, temperature=0.0, max_tokens=512)
-        self.researchAgent = ResearchAgent(serper_api_key=serper_api_key, search_type=search_type, breadth=breadth, before_timestamp=before_timestamp)
+        self.plannerAgent = get_llm_agent_class(model)(model=model, temperature=0.0, max_tokens=512, hedge=True, call_site="planner")
+        self.researchAgent = ResearchAgent(serper_api_key=serper_api_key, search_type=search_type, breadth=breadth, before_timestamp=before_timestamp,
+                                           research_deadline_ms=research_deadline_ms, min_sources=min_sources)
         self.factorizeAgent = get_llm_agent_class(model)(model=model, temperature=0.0, max_tokens=2048)
         self.publisherAgent = get_llm_agent_class(model)(model=model, temperature=0.0, max_tokens=2048)
 
@@ -38,7 +45,7 @@ class ForecastingMultiAgents:
         if self.researchAgent.before_date_str:
             self.today_string = self.researchAgent.before_date_str
         else: 
-            self.today_string = datetime.now().strftime(GOOGLE_SEARCH_DATE_FORMAT)
+            self.today_string = cassette_today(datetime.now().strftime(GOOGLE_SEARCH_DATE_FORMAT))
 
         if ENV_TYPE == "prod":
             self.related_forecast_agent = RelatedForecastAgent(model="gpt-4o-mini")
@@ -84,6 +91,17 @@ class ForecastingMultiAgents:
         return None
     
     async def completions(self, messages, depth=0):
+        with trace("forecasting", model=self.publisherAgent.model, breadth=self.breadth):
+            REQUESTS_IN_PROGRESS.inc()
+            try:
+                # Closed here rather than by the garbage collector, so its spans end with the request
+                async with aclosing(self._completions(messages)) as chunks:
+                    async for chunk in chunks:
+                        yield chunk
+            finally:
+                REQUESTS_IN_PROGRESS.dec()
+
+    async def _completions(self, messages):
         # Step 1 calling plannerAgent to generate search queries
         question = messages[-1]['content']
         if self.breadth < 1:
@@ -91,7 +109,8 @@ class ForecastingMultiAgents:
         else:
             planner_query = self.planner_prompt.format(question=question, breadth=self.breadth, today=self.today_string)
             planner_input = [dict(role="user", content=planner_query)]
-            planner_response = self.plannerAgent.completions(planner_input)
+            with span("planner"):
+                planner_response = await self.plannerAgent.async_completions(planner_input)
             
 
             if planner_response == self.plannerAgent.default_outputs:
@@ -103,9 +122,10 @@ class ForecastingMultiAgents:
             # Step 2 calling researchAgent to generate research content from search queries
             research_generator = self.researchAgent.research(search_queries, question=question)
             # Handle first yield: Fetched sources
-            async for sources in research_generator:
-                yield json.dumps(sources) + '[SEP_SOURCE]'
-                research_results = sources
+            with span("research", queries=len(search_queries)):
+                async for sources in research_generator:
+                    yield json.dumps(sources) + '[SEP_SOURCE]'
+                    research_results = sources
             # fetched_sources = await anext(research_generator)
             # yield json.dumps(fetched_sources) + '[SEP_SOURCE]'
 
@@ -123,16 +143,22 @@ class ForecastingMultiAgents:
         
         print("Total input length:", len(str(publishing_input).split()))
               
-        response = await self.publisherAgent.completions_stream(input)
-        
         yield "[FORECASTING_START]"
-        async for chunk in response:
-            yield chunk
+        with span("publisher", input_words=len(str(publishing_input).split())) as publisher_span:
+            first_token = True
+            async for chunk in self.publisherAgent.completions_stream(input):
+                if first_token:
+                    first_token = False
+                    first_token_seconds = perf_counter() - publisher_span.start
+                    publisher_span.set(first_token_seconds=first_token_seconds)
+                    PUBLISHER_FIRST_TOKEN_SECONDS.labels(provider=self.publisherAgent.provider,
+                                                         model=self.publisherAgent.model).observe(first_token_seconds)
+                yield chunk
         yield "[FORECASTING_END]"
 
         # if self.related_forecast_agent:
         #     #TODO: clean this to another endpoint later
-        #     related_forecasts = self.related_forecast_agent.completion(question=question.split("\n")[0])
+        #     related_forecasts = await self.related_forecast_agent.async_completion(question=question.split("\n")[0])
         #     yield '[SEP_RESPONSE]' + json.dumps(related_forecasts)
 
 async def forecasting_search_completions(messages: List, model: str):
@@ -1,91 +1,342 @@
+from abc import ABC, abstractmethod
 import asyncio
+import json
+import sqlite3
+import threading
 from urllib.parse import urlparse
 from motor.motor_asyncio import AsyncIOMotorClient
 from typing import Dict, Set, Optional, List
 import os
-from datetime import datetime, timezone
-from bson import ObjectId
+from datetime import datetime, timezone, timedelta
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import UpdateOne, ASCENDING
+from dotenv import load_dotenv
+load_dotenv()
 
-_client = AsyncIOMotorClient(os.environ.get("DATABASE_URL"))
-_client.get_io_loop = asyncio.get_running_loop
+# "mongo" (shared across workers), "sqlite" (embedded, local disk) or "memory" (process-local)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "mongo")
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "cache/forecasting_cache.sqlite3")
 
-class CachingAgent:
+# Seconds between incremental refreshes of the in-memory blacklist, and how many of them before a full reload
+BLACKLIST_REFRESH_INTERVAL = int(os.getenv("BLACKLIST_REFRESH_INTERVAL", 300))
+BLACKLIST_FULL_RELOAD_EVERY = int(os.getenv("BLACKLIST_FULL_RELOAD_EVERY", 12))
+
+# Fields each research stage reads from `sources`; raw_content is only loaded for sources without a summary
+SOURCE_PREVIEW_FIELDS = ["date", "favicon", "summarized_content"]
+SOURCE_CONTENT_FIELDS = ["raw_content"]
+# Cached sources older than this are refetched (live searches only; before-date research reuses them)
+SOURCE_MAX_AGE_DAYS = float(os.getenv("SOURCE_MAX_AGE_DAYS", 30))
+# Optional expiry (days since last update) for the sources and searches collections
+SOURCE_TTL_DAYS = float(os.getenv("SOURCE_TTL_DAYS") or 0) or None
+SEARCH_TTL_DAYS = float(os.getenv("SEARCH_TTL_DAYS") or 0) or None
+
+# Write-behind queue: bounded size; a batch is written this many seconds after its first write, or once full
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", 10000))
+WRITE_BEHIND_BATCH_DELAY = float(os.getenv("WRITE_BEHIND_BATCH_DELAY", 0.1))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 500))
+
+COLLECTION_TTL_DAYS = {'sources': SOURCE_TTL_DAYS, 'searches': SEARCH_TTL_DAYS, 'BlacklistedDomain': None}
+
+
+class BlacklistIndex:
+    """
+    Process-wide in-memory copy of the BlacklistedDomain collection.
+
+    Loaded once, then refreshed in the background from documents whose `updatedAt` moved
+    past the last one seen; a periodic full reload also picks up deletions and legacy
+    documents without `updatedAt`. Local `add_to_blacklist` calls update it directly.
+    Loads and refreshes go through an agent of its own, not through the request that started it.
+    """
     def __init__(self):
-        self.client = None
-        self.db = None
-        self.blacklisted_domains = None
-        self.sources = None
-        self.database_url = os.environ.get("DATABASE_URL")
+        self.domains: Set[str] = set()
+        self.loaded = False
+        self.last_updated = None
+        self.agent: Optional["CachingAgent"] = None
+        self._refresh_task = None
 
-    async def connect(self):
-        if self.client is None:
+    @property
+    def running(self) -> bool:
+        """Loaded and refreshing on the current event loop."""
+        return self.loaded and self._refresh_task is not None and not self._refresh_task.done() \
+            and self._refresh_task.get_loop() is asyncio.get_running_loop()
+
+    def add(self, domains: List[str]):
+        self.domains.update(domains)
+
+    def filter(self, domains: Set[str]) -> Set[str]:
+        return self.domains & set(domains)
+
+    def _track_updated(self, doc: Dict):
+        updated_at = doc.get('updatedAt')
+        if updated_at is not None and (self.last_updated is None or updated_at > self.last_updated):
+            self.last_updated = updated_at
+
+    async def load(self, agent: "CachingAgent"):
+        domains = set()
+        self.last_updated = None
+        for doc in await agent._find('BlacklistedDomain', fields=[], include_updated_at=True):
+            domains.add(doc['_id'])
+            self._track_updated(doc)
+        self.domains = domains
+        self.loaded = True
+        print(f"Loaded {len(domains)} blacklisted domains")
+
+    async def refresh(self, agent: "CachingAgent"):
+        for doc in await agent._find('BlacklistedDomain', fields=[], updated_after=self.last_updated, include_updated_at=True):
+            self.domains.add(doc['_id'])
+            self._track_updated(doc)
+
+    async def _refresh_forever(self, agent: "CachingAgent", interval: int):
+        refreshes = 0
+        while True:
+            await asyncio.sleep(interval)
+            refreshes += 1
             try:
-                global _client
-                self.client = _client
-                db_name = urlparse(self.database_url).path.strip('/')
-                self.db = self.client[db_name]
-                self.blacklisted_domains = self.db['BlacklistedDomain']
-                self.sources = self.db['sources']
-                print(f"Connected to MongoDB database caching db successfully")
+                if refreshes % BLACKLIST_FULL_RELOAD_EVERY == 0:
+                    await self.load(agent)
+                else:
+                    await self.refresh(agent)
             except Exception as e:
-                print(f"Error initializing MongoDB connection: {e}")
+                print(f"Error refreshing blacklisted domains: {e}")
+
+    async def start(self, agent_class: type, interval: int = BLACKLIST_REFRESH_INTERVAL):
+        if self.running:
+            return
+        if self.agent is None:
+            self.agent = agent_class()
+        await self.agent.connect()
+        if not self.agent.connected:
+            return
+        if not self.loaded:
+            await self.load(self.agent)
+        # The refresh task lives on the current event loop; restart it if that loop went away
+        self._refresh_task = asyncio.create_task(self._refresh_forever(self.agent, interval))
+
+    async def stop(self):
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        self._refresh_task = None
+
+_blacklist_index = BlacklistIndex()
+
+
+# Queued by `WriteBehindQueue.stop`: the flusher writes everything before it and exits
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    Process-wide queue of pending cache writes.
+
+    Requests enqueue upserts and return immediately; a background task coalesces them
+    across requests (last write per collection and `_id` wins) and applies them with one
+    bulk upsert per collection. Writes are dropped, not awaited, when the queue is full,
+    since the cache can always be refilled.
+
+    The queue and its flusher belong to the loop that started them, so only a long-lived
+    app that also stops (and so flushes) it should start it, as the FastAPI lifespan does.
+    """
+    def __init__(self, max_size: int = WRITE_BEHIND_MAX_QUEUE):
+        self.max_size = max_size
+        self.agent = None
+        self.stats = dict(enqueued=0, written=0, dropped=0)
+        self._queue: Optional[asyncio.Queue] = None
+        self._flush_task = None
+        self._dropping = False
+
+    @property
+    def started(self) -> bool:
+        return self._flush_task is not None and not self._flush_task.done() \
+            and self._flush_task.get_loop() is asyncio.get_running_loop()
+
+    def start(self, agent: "CachingAgent"):
+        if not self.started:
+            self.agent = agent
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+            self._flush_task = asyncio.create_task(self._flush_forever())
+
+    def put(self, collection: str, docs: Dict[str, Dict]):
+        for key, fields in docs.items():
+            try:
+                self._queue.put_nowait((collection, key, fields))
+                self.stats['enqueued'] += 1
+                self._dropping = False
+            except asyncio.QueueFull:
+                self.stats['dropped'] += 1
+                # Once per run of drops, not per write
+                if not self._dropping:
+                    self._dropping = True
+                    print(f"Write-behind queue full, dropping writes ({self.stats['dropped']} dropped so far)")
+
+    def _drain(self, limit: int) -> List:
+        items = []
+        while len(items) < limit and not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        return items
+
+    async def _write(self, items: List):
+        coalesced: Dict[str, Dict] = {}
+        for collection, key, fields in items:
+            coalesced.setdefault(collection, {})[key] = fields
+        current_time = datetime.now(timezone.utc)
+        for collection, docs in coalesced.items():
+            try:
+                await self.agent._upsert(collection, docs, current_time)
+                self.stats['written'] += len(docs)
+            except Exception as e:
+                print(f"Error flushing {len(docs)} writes to {collection}: {e}")
+
+    async def _flush_forever(self):
+        # Never cancelled while holding items: `stop` queues _STOP and waits for the batches before it
+        stopping = False
+        while not stopping:
+            items = [await self._queue.get()]
+            if items[0] is not _STOP:
+                # Give concurrent requests a moment to add to this batch
+                await asyncio.sleep(WRITE_BEHIND_BATCH_DELAY)
+                items += self._drain(WRITE_BEHIND_BATCH_SIZE - 1)
+            stopping = any(item is _STOP for item in items)
+            await self._write([item for item in items if item is not _STOP])
+        await self.flush()
+
+    async def flush(self):
+        while self._queue is not None and not self._queue.empty():
+            await self._write([item for item in self._drain(WRITE_BEHIND_BATCH_SIZE) if item is not _STOP])
+
+    async def stop(self):
+        """Write everything queued so far and stop the flusher."""
+        if self.started:
+            await self._queue.put(_STOP)
+            await self._flush_task
+        elif self._flush_task is not None:
+            # Its loop is gone (or it crashed); nothing can be awaited there any more
+            self._flush_task.cancel()
+        self._flush_task = None
+        await self.flush()
+
+_write_behind = WriteBehindQueue()
+
+
+class CachingAgent(ABC):
+    """
+    Cache of searches, fetched sources and failing domains.
+
+    Backends store three collections (`sources`, `searches`, `BlacklistedDomain`) of
+    documents keyed by `_id` and stamped with `createdAt`/`updatedAt`, and only implement
+    `connect`, `_find` and `_upsert`; everything else is shared.
+    """
+    def __init__(self):
+        self.connected = False
+        # Bytes read from the backend by this agent (one agent per research request)
+        self.bytes_read = 0
+
+    @abstractmethod
+    async def connect(self):
+        pass
+
+    @abstractmethod
+    async def _find(self, collection: str, ids: Optional[List[str]] = None, fields: Optional[List[str]] = None,
+                    updated_after: Optional[datetime] = None, include_updated_at: bool = False) -> List[Dict]:
+        """
+        Documents of `collection` (with `_id`), restricted to `ids` when given and to those updated
+        after `updated_after`, reading only `fields` (all fields if None).
+        """
+        pass
+
+    @abstractmethod
+    async def _upsert(self, collection: str, docs: Dict[str, Dict], current_time: datetime):
+        """Merge `docs[_id]` into each document (creating missing ones) and stamp `updatedAt`."""
+        pass
+
+    async def close(self):
+        pass
+
+    async def start_write_behind(self):
+        await self.connect()
+        if self.connected:
+            _write_behind.start(self)
+
+    @staticmethod
+    async def stop_write_behind():
+        # Flushes whatever is still queued
+        await _write_behind.stop()
+
+    async def _write(self, collection: str, docs: Dict[str, Dict]):
+        """
+        Queue upserts (keyed by `_id`) for the background writer when the app runs one, otherwise write them now:
+        entrypoints without a lifespan (ray workers' `asyncio.run`, scripts, the Modal functions) never flush a queue.
+        """
+        if _write_behind.started:
+            _write_behind.put(collection, docs)
+        else:
+            await self._upsert(collection, docs, datetime.now(timezone.utc))
+
+    async def start_blacklist_index(self):
+        if _blacklist_index.running:
+            return
+        try:
+            await _blacklist_index.start(type(self))
+        except Exception as e:
+            print(f"Error loading blacklisted domains: {e}")
+
+    @staticmethod
+    async def stop_blacklist_index():
+        await _blacklist_index.stop()
 
     async def check_blacklisted_domains(self, domains: Set[str]) -> Set[str]:
+        # Served from memory; the index is loaded on first use if the app did not warm it at startup
+        await self.start_blacklist_index()
+        if _blacklist_index.loaded:
+            return _blacklist_index.filter(domains)
+        await self.connect()
         try:
-            cursor = self.blacklisted_domains.find({"_id": {"$in": list(domains)}})
-            blacklisted = set()
-            async for doc in cursor:
-                blacklisted.add(doc['_id'])
-            return blacklisted
+            return {doc['_id'] for doc in await self._find('BlacklistedDomain', ids=list(domains), fields=[])}
         except Exception as e:
             print(f"Error checking blacklisted domains: {e}")
             return set()
-        
+
     async def add_to_blacklist(self, domains: List[Dict]):
-        if domains and self.blacklisted_domains != None:
+        if domains and self.connected:
             try:
-                documents = [{"_id": domain['domain'], 'url': domain["url"], "error_message": domain["error_message"]} for domain in domains]
-                await self.blacklisted_domains.insert_many(documents, ordered=False)
+                docs = {domain['domain']: {"url": domain["url"], "error_message": domain["error_message"]} for domain in domains}
+                _blacklist_index.add(list(docs))
+                await self._write('BlacklistedDomain', docs)
             except Exception as e:
                 print(f"Error adding domains to blacklist: {e}")
-        
-    async def check_existing_sources(self, links: List[str]):
+
+    async def check_existing_sources(self, links: List[str], fields: Optional[List[str]] = None,
+                                     max_age_seconds: Optional[float] = None):
+        """Return cached sources for `links`, reading only `fields` (all fields if None) and skipping stale ones."""
         try:
-            cursor = self.sources.find({"_id": {"$in": links}})
-            sources = []
-            async for doc in cursor:
-                sources.append(doc)
-            return sources
+            updated_after = datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds) if max_age_seconds is not None else None
+            return await self._find('sources', ids=links, fields=fields, updated_after=updated_after)
         except Exception as e:
             print(f"Error checking soures: {e}")
             return []
 
     async def get_source(self, link: str) -> Optional[Dict]:
         try:
-            source = await self.sources.find_one({"_id": ObjectId(link)})
-            if source:
-                source['_id'] = str(source['_id'])  # Convert ObjectId to string
-            return source
+            sources = await self._find('sources', ids=[link])
+            return sources[0] if sources else None
         except Exception as e:
             print(f"Error getting source: {e}")
             return None
 
     async def add_sources(self, sources: List[Dict]):
-        if sources and self.sources != None:
+        if sources and self.connected:
             try:
-                documents_to_insert = []
-                current_time = datetime.now(timezone.utc)
+                docs = {}
                 for source in sources:
                     doc = source.copy()  # Create a copy to avoid modifying the original
-                    doc['_id'] = doc['link']
-                    del doc['link']
-                    doc['createdAt'] = current_time
-                    doc['updatedAt'] = current_time
-                    documents_to_insert.append(doc)
-
-                if documents_to_insert:
-                    result = await self.sources.insert_many(documents_to_insert, ordered=False)
-                    print(f"Added {len(result.inserted_ids)} sources")
+                    link = doc.pop('link')
+                    doc.pop('_id', None)
+                    docs[link] = doc
+
+                if docs:
+                    await self._write('sources', docs)
+                    print(f"Queued {len(docs)} sources")
                 else:
                     print("No documents to insert")
             except Exception as e:
@@ -93,23 +344,268 @@ class CachingAgent:
 
     async def update_source(self, link: str, update_data: Dict):
         try:
-            update_data['updatedAt'] = datetime.utcnow()
-            await self.sources.update_one({"_id": ObjectId(link)}, {"$set": update_data})
+            await self._upsert('sources', {link: update_data}, datetime.now(timezone.utc))
         except Exception as e:
             print(f"Error updating source: {e}")
 
     async def add_query_to_source(self, link: str, query: str):
         try:
-            await self.sources.update_one(
-                {"_id": ObjectId(link)},
-                {
-                    "$addToSet": {"queries": query},
-                    "$set": {"updatedAt": datetime.utcnow()}
-                }
-            )
+            source = await self.get_source(link)
+            if source is not None and query not in source.get('queries', []):
+                await self._upsert('sources', {link: {"queries": source.get('queries', []) + [query]}}, datetime.now(timezone.utc))
         except Exception as e:
             print(f"Error adding query to source: {e}")
 
+    async def check_cached_searches(self, keys: List[str], max_age_seconds: Optional[int] = None) -> Dict[str, Dict]:
+        """Cached searches by key as dict(results, updatedAt), skipping those older than `max_age_seconds`."""
+        try:
+            updated_after = datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds) if max_age_seconds is not None else None
+            docs = await self._find('searches', ids=keys, fields=['results'], updated_after=updated_after, include_updated_at=True)
+            searches = {}
+            for doc in docs:
+                if 'results' not in doc:
+                    continue
+                updated_at = doc.get('updatedAt')
+                # Mongo returns naive datetimes in UTC
+                if updated_at is not None and updated_at.tzinfo is None:
+                    updated_at = updated_at.replace(tzinfo=timezone.utc)
+                searches[doc['_id']] = dict(results=doc['results'], updatedAt=updated_at)
+            return searches
+        except Exception as e:
+            print(f"Error checking cached searches: {e}")
+            return {}
+
+    async def add_searches(self, searches: Dict[str, Dict], before_date_str: Optional[str] = None):
+        if searches and self.connected:
+            try:
+                docs = {
+                    key: {
+                        "query": search['query'],
+                        "search_type": search['search_type'],
+                        "before_date_str": before_date_str,
+                        "results": search['results'],
+                    }
+                    for key, search in searches.items()
+                }
+                await self._write('searches', docs)
+            except Exception as e:
+                print(f"Error adding searches: {e}")
+
+
+# One motor client per process, created on first connect
+_client: Optional[AsyncIOMotorClient] = None
+_indexes_ensured = False
+_RAW_BSON_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+class MongoCachingAgent(CachingAgent):
+    def __init__(self):
+        super().__init__()
+        self.client = None
+        self.db = None
+        self.database_url = os.environ.get("DATABASE_URL")
+
+    async def connect(self):
+        if self.client is None:
+            try:
+                global _client
+                if _client is None:
+                    _client = AsyncIOMotorClient(self.database_url)
+                    _client.get_io_loop = asyncio.get_running_loop
+                self.client = _client
+                db_name = urlparse(self.database_url).path.strip('/')
+                self.db = self.client[db_name]
+                self.connected = True
+                print(f"Connected to MongoDB database caching db successfully")
+            except Exception as e:
+                print(f"Error initializing MongoDB connection: {e}")
+                return
+            await self.ensure_indexes()
+
+    async def ensure_indexes(self):
+        """Create the indexes our query patterns need, once per process (`_id` lookups use the default index)."""
+        global _indexes_ensured
+        if _indexes_ensured:
+            return
+        _indexes_ensured = True
+
+        # Freshness filters, incremental blacklist refreshes and TTL expiry all go through updatedAt
+        for collection, ttl_days in COLLECTION_TTL_DAYS.items():
+            index = dict(keys=[("updatedAt", ASCENDING)])
+            if ttl_days:
+                index['expireAfterSeconds'] = int(ttl_days * 24 * 60 * 60)
+            try:
+                await self.db[collection].create_index(**index)
+            except Exception as e:
+                # e.g. an existing updatedAt index with different TTL options; drop it to change the policy
+                print(f"Error creating index on {collection}: {e}")
+
+    async def _find(self, collection, ids=None, fields=None, updated_after=None, include_updated_at=False):
+        query = {}
+        if ids is not None:
+            query["_id"] = {"$in": ids}
+        if updated_after is not None:
+            query["updatedAt"] = {"$gt": updated_after}
+        projection = None
+        if fields is not None:
+            projection = {field: 1 for field in fields + (["updatedAt"] if include_updated_at else [])}
+            projection["_id"] = 1
+        # Fetch raw BSON so the bytes read are known without re-encoding every document
+        raw_collection = self.db[collection].with_options(codec_options=_RAW_BSON_OPTIONS)
+        docs = []
+        async for raw_doc in raw_collection.find(query, projection):
+            self.bytes_read += len(raw_doc.raw)
+            docs.append(bson.decode(raw_doc.raw))
+        return docs
+
+    async def _upsert(self, collection, docs, current_time):
+        operations = [
+            UpdateOne({"_id": key}, {"$set": {**fields, "updatedAt": current_time}, "$setOnInsert": {"createdAt": current_time}}, upsert=True)
+            for key, fields in docs.items()
+        ]
+        await self.db[collection].bulk_write(operations, ordered=False)
+
     async def close(self):
         if self.client:
-            self.client.close()
\ No newline at end of file
+            self.client.close()
+
+
+# One connection per database file, shared by every agent in the process; calls are serialized by the lock
+_sqlite_connections: Dict[str, sqlite3.Connection] = {}
+_sqlite_lock = threading.Lock()
+
+class SQLiteCachingAgent(CachingAgent):
+    """
+    Embedded cache for single-host deployments. Each collection is a table of
+    (`_id`, JSON document, `createdAt`, `updatedAt`); queries run in a worker thread.
+    """
+    # Stay under SQLite's bound-parameter limit
+    MAX_IDS_PER_QUERY = 500
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH):
+        super().__init__()
+        self.path = path
+        self.conn = None
+
+    def _open(self) -> sqlite3.Connection:
+        with _sqlite_lock:
+            if self.path not in _sqlite_connections:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                now = datetime.now(timezone.utc).timestamp()
+                for collection, ttl_days in COLLECTION_TTL_DAYS.items():
+                    conn.execute(f'CREATE TABLE IF NOT EXISTS "{collection}" '
+                                 '(_id TEXT PRIMARY KEY, doc TEXT NOT NULL, createdAt REAL NOT NULL, updatedAt REAL NOT NULL)')
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS "{collection}_updatedAt" ON "{collection}" (updatedAt)')
+                    # No background expiry here; the TTL is applied when the process opens the cache
+                    if ttl_days:
+                        conn.execute(f'DELETE FROM "{collection}" WHERE updatedAt < ?', (now - ttl_days * 24 * 60 * 60,))
+                conn.commit()
+                _sqlite_connections[self.path] = conn
+            return _sqlite_connections[self.path]
+
+    async def connect(self):
+        if self.conn is None:
+            try:
+                self.conn = await asyncio.to_thread(self._open)
+                self.connected = True
+            except Exception as e:
+                print(f"Error opening SQLite cache {self.path}: {e}")
+
+    def _chunks(self, ids: List[str]) -> List[List[str]]:
+        return [ids[i:i + self.MAX_IDS_PER_QUERY] for i in range(0, len(ids), self.MAX_IDS_PER_QUERY)]
+
+    def _find_sync(self, collection, ids, fields, updated_after, include_updated_at):
+        conditions, params = [], []
+        if updated_after is not None:
+            conditions.append("updatedAt > ?")
+            params.append(updated_after.timestamp())
+
+        docs = []
+        with _sqlite_lock:
+            for chunk in (self._chunks(ids) if ids is not None else [None]):
+                where = conditions + ([f"_id IN ({','.join('?' * len(chunk))})"] if chunk is not None else [])
+                sql = f'SELECT _id, doc, updatedAt FROM "{collection}"' + (f" WHERE {' AND '.join(where)}" if where else "")
+                for _id, raw, updated_at in self.conn.execute(sql, params + (chunk or [])):
+                    self.bytes_read += len(raw)
+                    doc = json.loads(raw)
+                    if fields is not None:
+                        doc = {field: doc[field] for field in fields if field in doc}
+                    doc['_id'] = _id
+                    if include_updated_at:
+                        doc['updatedAt'] = datetime.fromtimestamp(updated_at, timezone.utc)
+                    docs.append(doc)
+        return docs
+
+    async def _find(self, collection, ids=None, fields=None, updated_after=None, include_updated_at=False):
+        return await asyncio.to_thread(self._find_sync, collection, ids, fields, updated_after, include_updated_at)
+
+    def _upsert_sync(self, collection, docs, current_time):
+        timestamp = current_time.timestamp()
+        with _sqlite_lock:
+            # `$set` semantics: fields not in the update are kept
+            existing = {}
+            for chunk in self._chunks(list(docs)):
+                rows = self.conn.execute(f'SELECT _id, doc FROM "{collection}" WHERE _id IN ({",".join("?" * len(chunk))})', chunk)
+                existing.update({_id: json.loads(raw) for _id, raw in rows})
+            self.conn.executemany(
+                f'INSERT INTO "{collection}" (_id, doc, createdAt, updatedAt) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(_id) DO UPDATE SET doc = excluded.doc, updatedAt = excluded.updatedAt',
+                [(key, json.dumps({**existing.get(key, {}), **fields}, default=str), timestamp, timestamp) for key, fields in docs.items()],
+            )
+            self.conn.commit()
+
+    async def _upsert(self, collection, docs, current_time):
+        await asyncio.to_thread(self._upsert_sync, collection, docs, current_time)
+
+
+# collection -> _id -> {"doc", "createdAt", "updatedAt"}, shared by every agent in the process
+_memory_collections: Dict[str, Dict[str, Dict]] = {collection: {} for collection in COLLECTION_TTL_DAYS}
+
+class MemoryCachingAgent(CachingAgent):
+    """Process-local cache with no persistence, for tests and offline runs."""
+    async def connect(self):
+        self.connected = True
+
+    async def _find(self, collection, ids=None, fields=None, updated_after=None, include_updated_at=False):
+        records = _memory_collections[collection]
+        docs = []
+        for key in (ids if ids is not None else list(records)):
+            record = records.get(key)
+            if record is None or (updated_after is not None and record['updatedAt'] <= updated_after):
+                continue
+            doc = record['doc'] if fields is None else {field: record['doc'][field] for field in fields if field in record['doc']}
+            doc = {**doc, '_id': key}
+            if include_updated_at:
+                doc['updatedAt'] = record['updatedAt']
+            docs.append(doc)
+        return docs
+
+    async def _upsert(self, collection, docs, current_time):
+        records = _memory_collections[collection]
+        for key, fields in docs.items():
+            record = records.setdefault(key, dict(doc={}, createdAt=current_time))
+            record['doc'] = {**record['doc'], **fields}
+            record['updatedAt'] = current_time
+
+    @staticmethod
+    def clear():
+        for records in _memory_collections.values():
+            records.clear()
+
+
+def get_caching_agent_class(backend: Optional[str] = None):
+    backend = backend or CACHE_BACKEND
+    if backend == "mongo":
+        return MongoCachingAgent
+    elif backend == "sqlite":
+        return SQLiteCachingAgent
+    elif backend == "memory":
+        return MemoryCachingAgent
+    else:
+        raise NotImplementedError(f"Caching backend not found for {backend}")
+
+def get_caching_agent(backend: Optional[str] = None) -> CachingAgent:
+    return get_caching_agent_class(backend)()
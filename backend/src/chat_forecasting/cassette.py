@@ -0,0 +1,186 @@
+import os
+import json
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from time import time, monotonic
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+load_dotenv()
+
+# "record" captures Serper, article HTML and LLM traffic; "replay" serves it back without the network
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off")
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", "cassettes")
+# Replayed calls sleep for their recorded latency times this factor (0 = as fast as possible)
+CASSETTE_LATENCY_SCALE = float(os.getenv("CASSETTE_LATENCY_SCALE", 0))
+
+
+class CassetteMiss(Exception):
+    """Replay found no recording for a request."""
+
+
+class ReplayedError(Exception):
+    """An error that was raised by the live call when it was recorded."""
+
+
+def cassette_key(kind: str, request: Dict) -> str:
+    return hashlib.sha256(json.dumps([kind, request], sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Cassette:
+    """
+    Recorded external interactions, kept in `<directory>/cassette.sqlite3`.
+
+    Interactions are keyed by kind ("serper", "html", "llm", "llm_stream") and the hash of
+    the request; repeated identical requests (e.g. LLM calls at temperature > 0) are stored
+    as a sequence that replay cycles through. Searches and sources served from the caches
+    never reach the cassette, so record and replay with CACHE_BACKEND=memory and no
+    HTML_STORE_DIR for a complete, reproducible run.
+
+    Prompts embed today's date when no beforeTimestamp is given, so the date of the first
+    recording is stored with the cassette and `pinned_today` returns it on replay.
+    """
+    def __init__(self, directory: str, mode: str, latency_scale: float = CASSETTE_LATENCY_SCALE):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode {mode}")
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.stats = dict(recorded=0, replayed=0, misses=0)
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "cassette.sqlite3"), check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS interactions "
+                           "(key TEXT NOT NULL, seq INTEGER NOT NULL, kind TEXT NOT NULL, request TEXT NOT NULL, "
+                           "response TEXT NOT NULL, latency REAL NOT NULL, first_latency REAL, recorded_at REAL NOT NULL, "
+                           "PRIMARY KEY (key, seq))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+        self._counts: Dict[str, int] = dict(self._conn.execute("SELECT key, COUNT(*) FROM interactions GROUP BY key").fetchall())
+        self._replays: Dict[str, List[Dict]] = {}
+        self._cursors: Dict[str, int] = {}
+        if mode == "replay":
+            # Recordings are small next to what they stand in for; load them all up front
+            for key, response, latency, first_latency in self._conn.execute(
+                    "SELECT key, response, latency, first_latency FROM interactions ORDER BY key, seq"):
+                self._replays.setdefault(key, []).append(dict(response=json.loads(response), latency=latency, first_latency=first_latency))
+
+    def _record(self, kind: str, request: Dict, response: Dict, latency: float, first_latency: Optional[float] = None):
+        key = cassette_key(kind, request)
+        with self._lock:
+            seq = self._counts.get(key, 0)
+            self._counts[key] = seq + 1
+            self._conn.execute("INSERT OR REPLACE INTO interactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (key, seq, kind, json.dumps(request, default=str), json.dumps(response, default=str),
+                                latency, first_latency, time()))
+            self._conn.commit()
+            self.stats['recorded'] += 1
+
+    def pinned_today(self, today: str) -> str:
+        """The `today` of the recording: stored on the first call while recording, read back on replay."""
+        with self._lock:
+            if self.mode == "record":
+                self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('today', ?)", (today,))
+                self._conn.commit()
+            row = self._conn.execute("SELECT value FROM meta WHERE name = 'today'").fetchone()
+        return row[0] if row else today
+
+    def _next_replay(self, kind: str, request: Dict) -> Dict:
+        key = cassette_key(kind, request)
+        recordings = self._replays.get(key)
+        if not recordings:
+            self.stats['misses'] += 1
+            raise CassetteMiss(f"No {kind} recording for {json.dumps(request, default=str)[:200]}")
+        cursor = self._cursors.get(key, 0)
+        self._cursors[key] = cursor + 1
+        self.stats['replayed'] += 1
+        return recordings[cursor % len(recordings)]
+
+    @staticmethod
+    def _result(response: Dict):
+        if 'error' in response:
+            raise ReplayedError(response['error'])
+        return response['result']
+
+    async def call(self, kind: str, request: Dict, call: Callable[[], Awaitable]) -> Any:
+        """Run (and record) or replay `call()`, whose result must be JSON serializable."""
+        if self.mode == "replay":
+            recording = self._next_replay(kind, request)
+            if self.latency_scale:
+                await asyncio.sleep(recording['latency'] * self.latency_scale)
+            return self._result(recording['response'])
+
+        start = monotonic()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await asyncio.to_thread(self._record, kind, request, dict(error=f"{type(e).__name__}: {e}"), monotonic() - start)
+            raise
+        await asyncio.to_thread(self._record, kind, request, dict(result=result), monotonic() - start)
+        return result
+
+    async def stream(self, kind: str, request: Dict, stream_factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Like `call` for streams; replay spreads the recorded chunks over the recorded duration."""
+        if self.mode == "replay":
+            recording = self._next_replay(kind, request)
+            chunks = recording['response'].get('chunks', [])
+            if self.latency_scale and recording['first_latency'] is not None:
+                await asyncio.sleep(recording['first_latency'] * self.latency_scale)
+            gap = (recording['latency'] - (recording['first_latency'] or 0)) / max(len(chunks) - 1, 1) * self.latency_scale
+            for i, chunk in enumerate(chunks):
+                if i and gap:
+                    await asyncio.sleep(gap)
+                yield chunk
+            if 'error' in recording['response']:
+                raise ReplayedError(recording['response']['error'])
+            return
+
+        start, first_latency, chunks = monotonic(), None, []
+        try:
+            async for chunk in stream_factory():
+                if first_latency is None:
+                    first_latency = monotonic() - start
+                chunks.append(chunk)
+                yield chunk
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await asyncio.to_thread(self._record, kind, request, dict(chunks=chunks, error=f"{type(e).__name__}: {e}"),
+                                    monotonic() - start, first_latency)
+            raise
+        await asyncio.to_thread(self._record, kind, request, dict(chunks=chunks), monotonic() - start, first_latency)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cassette: Optional[Cassette] = None
+
+def get_cassette() -> Optional[Cassette]:
+    """The process-wide cassette, or None when CASSETTE_MODE is off."""
+    global _cassette
+    if CASSETTE_MODE == "off":
+        return None
+    if _cassette is None:
+        _cassette = Cassette(CASSETTE_DIR, CASSETTE_MODE)
+    return _cassette
+
+def cassette_today(today: str) -> str:
+    """`today` as pinned by the cassette, so date-stamped prompts replay on any day."""
+    cassette = get_cassette()
+    return today if cassette is None else cassette.pinned_today(today)
+
+async def cassette_call(kind: str, request: Dict, call: Callable[[], Awaitable]) -> Any:
+    cassette = get_cassette()
+    if cassette is None:
+        return await call()
+    return await cassette.call(kind, request, call)
+
+async def cassette_stream(kind: str, request: Dict, stream_factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+    cassette = get_cassette()
+    stream = stream_factory() if cassette is None else cassette.stream(kind, request, stream_factory)
+    async for chunk in stream:
+        yield chunk
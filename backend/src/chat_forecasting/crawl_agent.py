@@ -1,37 +1,95 @@
-import re
-import html
-from urllib.parse import urljoin
 from collections import OrderedDict
-from typing import List, Dict
+from typing import List, Dict, Optional
 from urllib.parse import urlparse
-from chat_forecasting.parse_date import DATE_FORMAT, UNKNOWN_TIME
-import newspaper
+from chat_forecasting.parse_date import UNKNOWN_TIME, date_from_str
 from datetime import datetime
-from time import time
-
-async def fetch_article_newspaper(url: str, timeout: int=5):
-    article = newspaper.article(url)
-    favicon_url = extract_favicon(article.html, url)
-    date = article.publish_date
-
-    date = date.strftime(DATE_FORMAT) if date else UNKNOWN_TIME
-    text = article.text
-    return dict(favicon=favicon_url, date=str(date), raw_content=text)
-
-def extract_favicon(html: str, base_url: str):
-    # Extract favicon
-    favicon_url = ""
-    favicon_match = re.search(r'<link[^>]*rel=["\'](icon|shortcut icon)["\'][^>]*href=["\'](.*?)["\']', html, re.IGNORECASE)
-    if favicon_match:
-        favicon_path = favicon_match.group(2)
-        favicon_url = urljoin(base_url, favicon_path)
-    else:
-        # Look for the first image if favicon is not found
-        img_match = re.search(r'<img[^>]*src=["\'](.*?)["\']', html)
-        if img_match:
-            img_path = img_match.group(1)
-            favicon_url = urljoin(base_url, img_path)
-    return favicon_url
+from time import perf_counter
+import os
+import asyncio
+import aiohttp
+from chat_forecasting.http_client import get_http_session, get_domain_limiter
+from chat_forecasting.fetch_pool import get_fetch_pool
+from chat_forecasting.extractors import extract_article
+from chat_forecasting.html_store import get_html_store, HTML_STORE_MAX_AGE_DAYS
+from chat_forecasting.cassette import cassette_call
+from chat_forecasting.domain_matcher import registrable_domain
+from chat_forecasting.telemetry import span, CACHE_LOOKUPS, FETCHES, FETCH_FAILURES
+
+REQUEST_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+# Per-URL deadlines (seconds): connecting, each socket read, and the whole fetch (download + extraction)
+FETCH_CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", 3))
+FETCH_READ_TIMEOUT = float(os.getenv("FETCH_READ_TIMEOUT", 5))
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", 10))
+# Candidates fetched concurrently per query; the first valid ones win and the rest are cancelled (1 = one at a time)
+FETCH_RACE_WIDTH = int(os.getenv("FETCH_RACE_WIDTH", 1))
+
+async def _download_from_network(url: str, timeout: float, stats: Optional[Dict]) -> str:
+    session = get_http_session()
+    client_timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=FETCH_CONNECT_TIMEOUT, sock_read=FETCH_READ_TIMEOUT)
+    async with session.get(url, headers=REQUEST_HEADERS, timeout=client_timeout) as response:
+        response.raise_for_status()
+        body = await response.read()
+        if stats is not None:
+            stats['bytes_downloaded'] += len(body)
+        return body.decode(response.get_encoding(), errors="replace")
+
+async def download_html(url: str, timeout: float = FETCH_TIMEOUT, stats: Optional[Dict] = None) -> str:
+    """Download `url`, reading it from the raw HTML store instead when a recent copy is there."""
+    store = get_html_store()
+    if store is not None:
+        try:
+            stored = await store.aget(url, max_age_seconds=HTML_STORE_MAX_AGE_DAYS * 24 * 60 * 60)
+            CACHE_LOOKUPS.labels(cache="html_store", result="hit" if stored is not None else "miss").inc()
+            if stored is not None:
+                if stats is not None:
+                    stats['html_store_hits'] += 1
+                return stored.decode("utf-8", errors="replace")
+        except Exception as e:
+            print(f"Error reading {url} from the HTML store: {e}")
+
+    html = await cassette_call("html", dict(url=url), lambda: _download_from_network(url, timeout, stats))
+
+    if store is not None:
+        try:
+            # Stored as UTF-8 so re-extraction does not depend on the response headers
+            await store.aput(url, html.encode("utf-8"))
+        except Exception as e:
+            print(f"Error writing {url} to the HTML store: {e}")
+    return html
+
+async def _download_and_extract(url: str, timeout: float, stats: Optional[Dict]):
+    # Download on the shared keep-alive session, extract (CPU bound) in the worker pool
+    html = await download_html(url, timeout, stats)
+    return await get_fetch_pool().submit(extract_article, url, html)
+
+class FetchDeadlineExceeded(asyncio.TimeoutError):
+    """Our own per-URL deadline ran out (possibly while queued on our side), not a failure of the site."""
+
+
+async def fetch_article(url: str, timeout: float = FETCH_TIMEOUT, stats: Optional[Dict] = None):
+    """
+    Fetch and extract `url` within `timeout` seconds, including the wait for one of its domain's slots.
+    Past the deadline the download is cancelled (an extraction already running in the pool is abandoned)
+    and FetchDeadlineExceeded is raised. Downloaded bytes are added to `stats['bytes_downloaded']` when given.
+    """
+    with span("fetch", url=url) as fetch_span:
+        async def _limited():
+            async with get_domain_limiter().limit(urlparse(url).netloc):
+                # Time spent waiting for one of the domain's slots
+                fetch_span.set(queued_seconds=round(perf_counter() - fetch_span.start, 6))
+                return await _download_and_extract(url, timeout, stats)
+
+        try:
+            return await asyncio.wait_for(_limited(), timeout)
+        except asyncio.TimeoutError as e:
+            # aiohttp's own connect/read timeouts are the site's; only the overall deadline is ours
+            if isinstance(e, aiohttp.ClientError):
+                raise
+            raise FetchDeadlineExceeded(f"Fetch timed out after {timeout}s")
 
 def deduplicate_search_links(search_results: List[List[Dict]]) -> List[List[Dict]]:
     seen_domains = OrderedDict()
@@ -57,52 +115,109 @@ def validate_time(before_timestamp, source_date_str):
     if source_date_str == UNKNOWN_TIME:
         return False
     
-    source_date = datetime.strptime(source_date_str, DATE_FORMAT)
+    source_date = date_from_str(source_date_str)
     before_date = datetime.fromtimestamp(before_timestamp)
     return source_date < before_date
 
+def new_fetch_stats() -> Dict[str, int]:
+    """Counters filled in by fetch_content; `bytes_wasted` is what was downloaded but not used."""
+    return dict(fetched=0, used=0, rejected=0, failed=0, cancelled=0, html_store_hits=0, bytes_downloaded=0, bytes_wasted=0)
+
 async def fetch_content(query, 
                         search_results, 
                         before_timestamp=None,
                         max_trials=3, 
                         depth=1,
                         max_length: int = 2048,
-                        existed_sources: Dict = {}
+                        existed_sources: Dict = {},
+                        race_width: int = FETCH_RACE_WIDTH,
+                        stats: Optional[Dict] = None,
                         ):
+    """
+    Fetch search results in order until `depth` of them pass the date check.
+
+    Up to `race_width` downloads run at once: a failure or date rejection immediately starts the
+    next candidate, and once `depth` articles are in the remaining downloads are cancelled.
+    At most `max_trials` downloads per query, so its latency is bounded by
+    ceil(max_trials / race_width) * FETCH_TIMEOUT.
+    """
+    stats = stats if stats is not None else new_fetch_stats()
     trial = 0
     return_results = []
     failed_domains = []
-    while len(search_results) and len(return_results) < depth:
-        try:
-            current = search_results.pop(0)
+    candidates = iter(search_results)
+    running = {}
+
+    def _accept(current, content):
+        if len(return_results) >= depth or not validate_time(before_timestamp, content['date']):
+            return False
+        return_results.append({
+            **current,
+            **content,
+            "query": query,
+
+        })
+        return True
+
+    def _schedule():
+        nonlocal trial
+        while len(return_results) < depth and len(running) < race_width and trial < max_trials:
+            current = next(candidates, None)
+            if current is None:
+                return
             url = current['link']
             if url in existed_sources:
-                content = existed_sources[url]
-            else:
-                content = await fetch_article_newspaper(url)
-                content['raw_content'] = " ".join(content['raw_content'].split()[:max_length])
-                content['summarized_content'] = None
-
-            if not validate_time(before_timestamp, content['date']):
+                _accept(current, existed_sources[url])
                 continue
-            
-            return_results.append({
-                **current,
-                **content,
-                "query": query,
+            trial += 1
+            fetch_stats = dict(bytes_downloaded=0, html_store_hits=0)
+            running[asyncio.create_task(fetch_article(url, stats=fetch_stats))] = (current, fetch_stats)
 
-            })
+    try:
+        _schedule()
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                current, fetch_stats = running.pop(task)
+                url = current['link']
+                stats['fetched'] += 1
+                stats['bytes_downloaded'] += fetch_stats['bytes_downloaded']
+                stats['html_store_hits'] += fetch_stats['html_store_hits']
+                try:
+                    content = task.result()
+                    content['raw_content'] = " ".join(content['raw_content'].split()[:max_length])
+                    content['summarized_content'] = None
+                    if _accept(current, content):
+                        stats['used'] += 1
+                        FETCHES.labels(outcome="used").inc()
+                        continue
+                    stats['rejected'] += 1
+                    FETCHES.labels(outcome="rejected").inc()
+                except Exception as e:
+                    stats['failed'] += 1
+                    FETCHES.labels(outcome="failed").inc()
+                    FETCH_FAILURES.labels(domain=registrable_domain(urlparse(url).netloc)).inc()
+                    print(f"URL Failed {url}: ", str(e))
+                    # Only blacklist on HTTP/connection failures of the site itself: not on our own deadline
+                    # (queueing for a domain slot or the extraction pool under load) or extraction errors.
+                    # Temporary skip PerimeterX as it seem to able to bypass
+                    # TODO: bypass PerimeterX
+                    if isinstance(e, aiohttp.ClientError) and "PerimeterX" not in str(e):
+                        domain = urlparse(url).netloc.lower()
+                        failed_domains.append(dict(domain=domain, url=url, error_message=str(e)))
+                stats['bytes_wasted'] += fetch_stats['bytes_downloaded']
+            if len(return_results) >= depth:
+                break
+            _schedule()
+    finally:
+        # Losers of the race (or everything, if our caller was cancelled)
+        for task, (_, fetch_stats) in running.items():
+            task.cancel()
+            stats['cancelled'] += 1
+            FETCHES.labels(outcome="cancelled").inc()
+            stats['bytes_downloaded'] += fetch_stats['bytes_downloaded']
+            stats['bytes_wasted'] += fetch_stats['bytes_downloaded']
 
-        except Exception as e:
-            print(f"URL Failed {url}: ", str(e))
-            # Temporary skip this block as it seem to able to bypass
-            # TODO: bypass PerimeterX
-            if "PerimeterX" in str(e):
-                continue
-            domain = urlparse(url).netloc.lower()
-            failed_domains.append(dict(domain=domain, url=url, error_message=str(e)))
-            if trial == max_trials - 1:
-                print(f"Failed to fetch any article for query: {query}")
-            continue
-            
-    return return_results, failed_domains
\ No newline at end of file
+    if not return_results and trial:
+        print(f"Failed to fetch any article for query: {query}")
+    return return_results, failed_domains
@@ -0,0 +1,95 @@
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+
+# Second-level public suffixes we see in news links; a host's labels left of the public suffix are its names
+MULTI_LABEL_SUFFIXES = {
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "com.au", "net.au", "org.au", "co.nz", "co.jp", "ne.jp", "co.in",
+    "co.kr", "co.za", "com.br", "com.cn", "com.hk", "com.sg", "com.tw", "com.mx", "com.ar", "com.tr", "co.il",
+}
+# Host and path of a URL or bare host, without the cost of a full urlsplit
+URL_RE = re.compile(r'^(?:(?:[a-z][a-z0-9+.-]*:)?//)?([^/?#]*)([^?#]*)', re.IGNORECASE)
+# Bound on the per-matcher host memo
+HOST_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=65536)
+def split_host(host: str) -> Tuple[Tuple[str, ...], str]:
+    """Normalize a host and split it into (names left of the public suffix, public suffix)."""
+    host = host.strip().lower().rstrip(".")
+    host = host.rsplit("@", 1)[-1].split(":", 1)[0]
+    labels = host.split(".")
+    if len(labels) >= 3 and ".".join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return tuple(labels[:-2]), ".".join(labels[-2:])
+    if len(labels) >= 2:
+        return tuple(labels[:-1]), labels[-1]
+    return tuple(labels), ""
+
+def registrable_domain(host: str) -> str:
+    """e.g. "edition.cnn.com" -> "cnn.com", "news.bbc.co.uk" -> "bbc.co.uk"."""
+    names, suffix = split_host(host)
+    if not names:
+        return suffix
+    return f"{names[-1]}.{suffix}" if suffix else names[-1]
+
+
+class DomainMatcher:
+    """
+    Compiled set of domain rules, matched in one pass over a URL's host labels and path.
+
+    Rules come in three kinds, told apart by their shape:
+      - "youtube.com": the domain itself and all of its subdomains
+      - "nytimes": any host with that label left of the public suffix (nytimes.com, cooking.nytimes.com)
+      - ".pdf": URLs whose path ends with that extension
+    """
+    def __init__(self, rules: Iterable[str]):
+        self.rules = list(rules)
+        self.domains = set()
+        self.labels = set()
+        self.extensions = []
+        for rule in self.rules:
+            rule = rule.strip().lower()
+            if not rule:
+                continue
+            if rule.startswith("."):
+                self.extensions.append(rule)
+            elif "." in rule:
+                self.domains.add(rule.rstrip("."))
+            else:
+                self.labels.add(rule)
+        self.extensions = tuple(self.extensions)
+        self._host_cache: Dict[str, Optional[str]] = {}
+
+    def match_host(self, host: str) -> Optional[str]:
+        """Return the rule matching `host`, if any."""
+        if host not in self._host_cache:
+            if len(self._host_cache) >= HOST_CACHE_SIZE:
+                self._host_cache.clear()
+            self._host_cache[host] = self._match_host(host)
+        return self._host_cache[host]
+
+    def _match_host(self, host: str) -> Optional[str]:
+        names, suffix = split_host(host)
+        for name in names:
+            if name in self.labels:
+                return name
+        if self.domains:
+            # Walk suffixes from the registrable domain outwards: bbc.co.uk, news.bbc.co.uk, ...
+            domain = suffix
+            for name in reversed(names):
+                domain = f"{name}.{domain}" if domain else name
+                if domain in self.domains:
+                    return domain
+        return None
+
+    def match(self, url: str) -> Optional[str]:
+        """Return the rule matching `url` (a full URL or a bare host), if any."""
+        host, path = URL_RE.match(url).groups()
+        if self.extensions:
+            path = path.lower()
+            if path.endswith(self.extensions):
+                return next(extension for extension in self.extensions if path.endswith(extension))
+        return self.match_host(host)
+
+    def __contains__(self, url: str) -> bool:
+        return self.match(url) is not None
@@ -0,0 +1,207 @@
+import os
+import re
+import json
+from datetime import datetime
+from collections import defaultdict
+from urllib.parse import urljoin
+from typing import Callable, Dict, List, Optional
+import lxml.html
+from lxml import etree
+import newspaper
+from chat_forecasting.parse_date import DATE_FORMAT, UNKNOWN_TIME, parse_date
+from dotenv import load_dotenv
+load_dotenv()
+
+# Extractors tried in order for each page; the first one that succeeds wins (later ones may still supply its date)
+ARTICLE_EXTRACTORS = [name.strip() for name in os.getenv("ARTICLE_EXTRACTORS", "lxml,newspaper").split(",") if name.strip()]
+# Below this many words the lxml extractor gives up and leaves the page to the next extractor
+MIN_ARTICLE_WORDS = int(os.getenv("MIN_ARTICLE_WORDS", 50))
+# Paragraphs shorter than this (characters) are treated as boilerplate: bylines, captions, share buttons
+MIN_PARAGRAPH_CHARS = 25
+
+# Publish-date meta keys (property, name or itemprop), most reliable first
+DATE_META_KEYS = [
+    'article:published_time',
+    'og:published_time',
+    'datepublished',
+    'pubdate',
+    'publishdate',
+    'publish-date',
+    'dc.date.issued',
+    'dc.date',
+    'date',
+]
+# Dates in article URL paths: /2024/05/14/, /2024-05-14/, /20240514/
+URL_DATE_RE = re.compile(r'/((?:19|20)\d{2})[/-](0?[1-9]|1[0-2])[/-](0?[1-9]|[12]\d|3[01])(?:[/_.-]|$)|/((?:19|20)\d{2})(0[1-9]|1[0-2])(0[1-9]|[12]\d|3[01])(?:[/_.-]|$)')
+BOILERPLATE_TAGS = ["script", "style", "noscript", "nav", "header", "footer", "aside", "form", "iframe", "svg", "button"]
+
+# Documents are passed in as str; the parser always gets UTF-8 bytes so encoding declarations are ignored
+_HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8", remove_comments=True)
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def extract_article_lxml(url: str, html: str) -> Dict:
+    """
+    Single-pass extraction: one lxml parse gives the favicon, the publish date (meta tags,
+    JSON-LD, <time>, then the URL path) and the main text (the block holding most of the paragraph text).
+    Raises ExtractionError when the page does not look like an article.
+    """
+    if not html or not html.strip():
+        raise ExtractionError("Empty document")
+    try:
+        doc = lxml.html.document_fromstring(html.encode("utf-8", "replace"), parser=_HTML_PARSER)
+    except (etree.ParserError, ValueError) as e:
+        raise ExtractionError(f"Failed to parse HTML: {e}")
+
+    # Favicon and date first: both read elements (e.g. JSON-LD scripts) that are stripped below
+    favicon = _extract_favicon(doc, url)
+    date = _extract_date(doc)
+    if date == UNKNOWN_TIME:
+        date = url_date(url)
+
+    etree.strip_elements(doc, *BOILERPLATE_TAGS, with_tail=False)
+    text = _extract_text(doc)
+    if len(text.split()) < MIN_ARTICLE_WORDS:
+        raise ExtractionError(f"Too little article text ({len(text.split())} words)")
+    return dict(favicon=favicon, date=date, raw_content=text)
+
+def _extract_favicon(doc, base_url: str) -> str:
+    for link in doc.iter('link'):
+        if (link.get('rel') or '').strip().lower() in ('icon', 'shortcut icon') and link.get('href'):
+            return urljoin(base_url, link.get('href'))
+    # Look for the first image if favicon is not found
+    for img in doc.iter('img'):
+        if img.get('src'):
+            return urljoin(base_url, img.get('src'))
+    return ""
+
+def _json_ld_date(data) -> Optional[str]:
+    if isinstance(data, list):
+        for item in data:
+            date = _json_ld_date(item)
+            if date:
+                return date
+    elif isinstance(data, dict):
+        if isinstance(data.get('datePublished'), str):
+            return data['datePublished']
+        return _json_ld_date(data.get('@graph'))
+    return None
+
+def _extract_date(doc) -> str:
+    candidates = {}
+    for meta in doc.iter('meta'):
+        key = (meta.get('property') or meta.get('name') or meta.get('itemprop') or '').strip().lower()
+        if key in DATE_META_KEYS and meta.get('content') and key not in candidates:
+            candidates[key] = meta.get('content')
+    for key in DATE_META_KEYS:
+        if key in candidates:
+            date = parse_date(candidates[key])
+            if date != UNKNOWN_TIME:
+                return date
+
+    for script in doc.xpath('//script[@type="application/ld+json"]'):
+        try:
+            date = _json_ld_date(json.loads(script.text or ""))
+        except ValueError:
+            continue
+        if date:
+            date = parse_date(date)
+            if date != UNKNOWN_TIME:
+                return date
+
+    for time_tag in doc.iter('time'):
+        if time_tag.get('datetime'):
+            date = parse_date(time_tag.get('datetime'))
+            if date != UNKNOWN_TIME:
+                return date
+    return UNKNOWN_TIME
+
+def url_date(url: str) -> str:
+    """Publish date from a dated URL path (e.g. /2024/05/14/slug), or UNKNOWN_TIME."""
+    match = URL_DATE_RE.search(url)
+    if not match:
+        return UNKNOWN_TIME
+    year, month, day = [int(g) for g in match.groups() if g is not None]
+    try:
+        return datetime(year, month, day).strftime(DATE_FORMAT)
+    except ValueError:
+        return UNKNOWN_TIME
+
+def _extract_text(doc) -> str:
+    paragraphs = []
+    scores = defaultdict(float)
+    for p in doc.iter('p'):
+        text = " ".join(p.text_content().split())
+        if len(text) < MIN_PARAGRAPH_CHARS:
+            continue
+        paragraphs.append((p, text))
+        # Credit the enclosing block, and its parent a little, for each paragraph of text
+        parent = p.getparent()
+        if parent is not None:
+            scores[parent] += len(text)
+            if parent.getparent() is not None:
+                scores[parent.getparent()] += len(text) / 2
+
+    if not scores:
+        return ""
+    best = max(scores, key=scores.get)
+    return "\n\n".join(text for p, text in paragraphs if best in p.iterancestors())
+
+
+def extract_article_newspaper(url: str, html: str) -> Dict:
+    # Only the text and date are used: do not download the page's images to pick a top image
+    article = newspaper.Article(url, fetch_images=False)
+    article.download(input_html=html)
+    article.parse()
+    favicon_url = extract_favicon(article.html, url)
+    date = article.publish_date
+
+    date = date.strftime(DATE_FORMAT) if date else UNKNOWN_TIME
+    text = article.text
+    return dict(favicon=favicon_url, date=str(date), raw_content=text)
+
+def extract_favicon(html: str, base_url: str):
+    # Extract favicon
+    favicon_url = ""
+    favicon_match = re.search(r'<link[^>]*rel=["\'](icon|shortcut icon)["\'][^>]*href=["\'](.*?)["\']', html, re.IGNORECASE)
+    if favicon_match:
+        favicon_path = favicon_match.group(2)
+        favicon_url = urljoin(base_url, favicon_path)
+    else:
+        # Look for the first image if favicon is not found
+        img_match = re.search(r'<img[^>]*src=["\'](.*?)["\']', html)
+        if img_match:
+            img_path = img_match.group(1)
+            favicon_url = urljoin(base_url, img_path)
+    return favicon_url
+
+
+EXTRACTORS: Dict[str, Callable[[str, str], Dict]] = {
+    "lxml": extract_article_lxml,
+    "newspaper": extract_article_newspaper,
+}
+
+def extract_article(url: str, html: str, extractors: Optional[List[str]] = None) -> Dict:
+    """
+    Run the configured extractors in order and return the first successful result. An undated
+    result takes its date from the next extractor that finds one, so validate_time does not drop it.
+    """
+    error, result = None, None
+    for name in extractors or ARTICLE_EXTRACTORS:
+        try:
+            extracted = EXTRACTORS[name](url, html)
+        except Exception as e:
+            error = e
+            continue
+        if result is None:
+            result = extracted
+        elif extracted['date'] != UNKNOWN_TIME:
+            result['date'] = extracted['date']
+        if result['date'] != UNKNOWN_TIME:
+            return result
+    if result is not None:
+        return result
+    raise error or ExtractionError("No article extractors configured")
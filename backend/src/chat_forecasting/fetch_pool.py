@@ -0,0 +1,85 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+from dotenv import load_dotenv
+load_dotenv()
+
+FETCH_POOL_WORKERS = int(os.getenv("FETCH_POOL_WORKERS") or os.cpu_count() or 1)
+
+def _init_worker():
+    # Runs once per worker process: pay the lxml/newspaper imports up front
+    import chat_forecasting.extractors  # noqa: F401
+
+def _warmup(_):
+    return os.getpid()
+
+
+class FetchWorkerPool:
+    """
+    Process-wide pool of warm workers for CPU-bound article extraction.
+
+    Workers import the extractors once, so a request only pays for task submission
+    instead of forking a fresh pool. Downloads stay on the caller's event loop.
+    Starting blocks until every worker is up, so async code starts it in a thread.
+    """
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or FETCH_POOL_WORKERS
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+                # Spawn every worker now rather than on the first requests
+                list(executor.map(_warmup, range(self.max_workers)))
+                self._executor = executor
+                print(f"Started fetch worker pool with {self.max_workers} workers")
+
+    async def submit(self, function, *args):
+        """Run the picklable function `function(*args)` in a worker process, starting the pool off the event loop if needed."""
+        if not self.started:
+            await asyncio.to_thread(self.start)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, function, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM); replace the pool so later requests keep working
+            print("Fetch worker pool is broken, restarting")
+            self.shutdown(wait=False)
+            raise
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_fetch_pool: Optional[FetchWorkerPool] = None
+
+def start_fetch_pool(max_workers: Optional[int] = None) -> FetchWorkerPool:
+    """Start the shared pool now (blocking); call it from startup code, e.g. via `asyncio.to_thread`."""
+    pool = get_fetch_pool(max_workers)
+    pool.start()
+    return pool
+
+def get_fetch_pool(max_workers: Optional[int] = None) -> FetchWorkerPool:
+    # Callers outside of the app lifecycle (scripts, ray workers, Modal) get a pool that starts on first submit
+    global _fetch_pool
+    if _fetch_pool is None:
+        _fetch_pool = FetchWorkerPool(max_workers)
+    return _fetch_pool
+
+def shutdown_fetch_pool(wait: bool = True):
+    global _fetch_pool
+    if _fetch_pool is not None:
+        _fetch_pool.shutdown(wait=wait)
+        _fetch_pool = None
@@ -0,0 +1,144 @@
+import os
+import mmap
+import fcntl
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from time import time
+from typing import Dict, Iterator, Optional, Tuple
+import zstandard
+from dotenv import load_dotenv
+load_dotenv()
+
+# Directory of the raw HTML store; unset disables it
+HTML_STORE_DIR = os.getenv("HTML_STORE_DIR")
+# Stored pages older than this are refetched by crawl_agent (re-processing jobs read everything)
+HTML_STORE_MAX_AGE_DAYS = float(os.getenv("HTML_STORE_MAX_AGE_DAYS", 30))
+HTML_STORE_ZSTD_LEVEL = int(os.getenv("HTML_STORE_ZSTD_LEVEL", 3))
+# A new pack file is started once the current one is this large
+HTML_STORE_PACK_SIZE = int(os.getenv("HTML_STORE_PACK_SIZE", 256 * 1024 * 1024))
+
+
+class HTMLStore:
+    """
+    Content-addressed, zstd-compressed store of raw article HTML on local disk.
+
+    Each distinct page body is stored once (keyed by its sha256) as a zstd frame appended
+    to a pack file. A SQLite index maps hash -> (pack, offset, length) and records every
+    (url, fetched_at) -> hash, so pages can be re-extracted without downloading them again.
+    Single reads use pread; bulk reads memory-map each pack once and walk it in order.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.join(path, "packs"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(path, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS blobs "
+                           "(hash TEXT PRIMARY KEY, pack INTEGER NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL, size INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS fetches "
+                           "(url TEXT NOT NULL, fetched_at REAL NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (url, fetched_at))")
+        self._conn.commit()
+        self._compressor = zstandard.ZstdCompressor(level=HTML_STORE_ZSTD_LEVEL)
+        self._pack = self._conn.execute("SELECT COALESCE(MAX(pack), 0) FROM blobs").fetchone()[0]
+
+    def _pack_path(self, pack: int) -> str:
+        return os.path.join(self.path, "packs", f"{pack:06d}.pack")
+
+    def put(self, url: str, html: bytes, fetched_at: Optional[float] = None) -> str:
+        """Store `html` as fetched from `url` and return its content hash."""
+        content_hash = hashlib.sha256(html).hexdigest()
+        fetched_at = fetched_at if fetched_at is not None else time()
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (content_hash,)).fetchone()
+            if not exists:
+                frame = self._compressor.compress(html)
+                if os.path.exists(self._pack_path(self._pack)) and os.path.getsize(self._pack_path(self._pack)) + len(frame) > HTML_STORE_PACK_SIZE:
+                    self._pack += 1
+                with open(self._pack_path(self._pack), "ab") as f:
+                    # Other worker processes may append to the same pack
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(frame)
+                self._conn.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?, ?)", (content_hash, self._pack, offset, len(frame), len(html)))
+            self._conn.execute("INSERT OR REPLACE INTO fetches VALUES (?, ?, ?)", (url, fetched_at, content_hash))
+            self._conn.commit()
+        return content_hash
+
+    def _read_blob(self, pack: int, offset: int, length: int) -> bytes:
+        fd = os.open(self._pack_path(pack), os.O_RDONLY)
+        try:
+            frame = os.pread(fd, length, offset)
+        finally:
+            os.close(fd)
+        return zstandard.ZstdDecompressor().decompress(frame)
+
+    def get(self, url: str, max_age_seconds: Optional[float] = None) -> Optional[bytes]:
+        """Latest stored HTML of `url`, if fetched within `max_age_seconds`."""
+        min_fetched_at = time() - max_age_seconds if max_age_seconds is not None else 0
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT b.pack, b.offset, b.length FROM fetches f JOIN blobs b ON f.hash = b.hash "
+                "WHERE f.url = ? AND f.fetched_at >= ? ORDER BY f.fetched_at DESC LIMIT 1",
+                (url, min_fetched_at),
+            ).fetchone()
+        return self._read_blob(*row) if row else None
+
+    def iter_pages(self, latest_only: bool = True) -> Iterator[Tuple[str, float, bytes]]:
+        """
+        Yield `(url, fetched_at, html)` for every stored fetch (or each URL's latest), for offline
+        re-processing. Pages are read in pack order from memory-mapped packs.
+        """
+        query = ("SELECT f.url, f.fetched_at, b.pack, b.offset, b.length FROM fetches f JOIN blobs b ON f.hash = b.hash")
+        if latest_only:
+            query += " WHERE f.fetched_at = (SELECT MAX(fetched_at) FROM fetches WHERE url = f.url)"
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY b.pack, b.offset").fetchall()
+
+        decompressor = zstandard.ZstdDecompressor()
+        current_pack, mapped, f = None, None, None
+        try:
+            for url, fetched_at, pack, offset, length in rows:
+                if pack != current_pack:
+                    if mapped is not None:
+                        mapped.close()
+                        f.close()
+                    f = open(self._pack_path(pack), "rb")
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    current_pack = pack
+                yield url, fetched_at, decompressor.decompress(mapped[offset:offset + length])
+        finally:
+            if mapped is not None:
+                mapped.close()
+                f.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            fetches, urls = self._conn.execute("SELECT COUNT(*), COUNT(DISTINCT url) FROM fetches").fetchone()
+            blobs, stored, raw = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return dict(fetches=fetches, urls=urls, blobs=blobs, stored_bytes=stored, raw_bytes=raw,
+                    compression_ratio=raw / stored if stored else None)
+
+    async def aget(self, url: str, max_age_seconds: Optional[float] = None) -> Optional[bytes]:
+        return await asyncio.to_thread(self.get, url, max_age_seconds)
+
+    async def aput(self, url: str, html: bytes, fetched_at: Optional[float] = None) -> str:
+        return await asyncio.to_thread(self.put, url, html, fetched_at)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_html_stores: Dict[str, HTMLStore] = {}
+
+def get_html_store(path: Optional[str] = None) -> Optional[HTMLStore]:
+    """The process-wide store at `path` (default HTML_STORE_DIR), or None when the store is disabled."""
+    path = path or HTML_STORE_DIR
+    if not path:
+        return None
+    if path not in _html_stores:
+        _html_stores[path] = HTMLStore(path)
+    return _html_stores[path]
@@ -0,0 +1,87 @@
+import os
+import asyncio
+import weakref
+import aiohttp
+from contextlib import asynccontextmanager
+from typing import Dict
+from chat_forecasting.domain_matcher import registrable_domain
+from dotenv import load_dotenv
+load_dotenv()
+
+HTTP_CONNECTION_LIMIT = int(os.getenv("HTTP_CONNECTION_LIMIT", 200))
+HTTP_CONNECTION_LIMIT_PER_HOST = int(os.getenv("HTTP_CONNECTION_LIMIT_PER_HOST", 10))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+HTTP_KEEPALIVE_TIMEOUT = int(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+HTTP_DEFAULT_TIMEOUT = int(os.getenv("HTTP_DEFAULT_TIMEOUT", 30))
+# Article downloads in flight per registrable domain, across all requests of the process
+DOMAIN_MAX_CONCURRENCY = int(os.getenv("DOMAIN_MAX_CONCURRENCY", 4))
+
+# Session shared by Serper search and article downloads; a session belongs to one event loop, so one per loop
+_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+
+def _create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_CONNECTION_LIMIT,
+        limit_per_host=HTTP_CONNECTION_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        use_dns_cache=True,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=HTTP_DEFAULT_TIMEOUT))
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Return the shared connection-pooled session for the running event loop.
+
+    The session is normally opened by the app lifespan; it is created lazily here
+    for scripts and workers that run their own event loop (e.g. `asyncio.run`),
+    which must `await close_http_session()` before their loop ends.
+    """
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = _sessions[loop] = _create_session()
+    return session
+
+async def close_http_session():
+    """Close the running loop's session and its pooled connections."""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+class DomainConcurrencyLimiter:
+    """
+    Caps concurrent requests per registrable domain (www.bbc.co.uk and news.bbc.co.uk share a cap),
+    so a burst of research requests cannot pile onto one slow publisher. Idle domains are forgotten.
+    """
+    def __init__(self, max_concurrency: int = DOMAIN_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._users: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def limit(self, host: str):
+        domain = registrable_domain(host)
+        if domain not in self._semaphores:
+            self._semaphores[domain] = asyncio.Semaphore(self.max_concurrency)
+        self._users[domain] = self._users.get(domain, 0) + 1
+        try:
+            async with self._semaphores[domain]:
+                yield
+        finally:
+            self._users[domain] -= 1
+            if not self._users[domain]:
+                del self._users[domain], self._semaphores[domain]
+
+    def in_flight(self) -> Dict[str, int]:
+        return dict(self._users)
+
+# asyncio primitives belong to one event loop, so limiters are kept per loop
+_domain_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, DomainConcurrencyLimiter]" = weakref.WeakKeyDictionary()
+
+def get_domain_limiter() -> DomainConcurrencyLimiter:
+    loop = asyncio.get_running_loop()
+    if loop not in _domain_limiters:
+        _domain_limiters[loop] = DomainConcurrencyLimiter()
+    return _domain_limiters[loop]
@@ -1,12 +1,17 @@
 from abc import ABC, abstractmethod
 import os
 import openai
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 from fireworks.client import Fireworks, AsyncFireworks
 
-from typing import List, Dict
+from typing import List, Dict, AsyncIterator
+from time import monotonic
+from chat_forecasting.rate_limiter import get_rate_limiter, estimate_tokens
+from chat_forecasting.retry import retry_async, is_transient_error, hedged, get_latency_tracker, HEDGE_PERCENTILE
+from chat_forecasting.cassette import cassette_call, cassette_stream
+from chat_forecasting.telemetry import LLM_TOKENS
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -24,10 +29,17 @@ def get_llm_agent_class(model: str):
 
 
 class LLMAgent(ABC):
+    # Key of the shared rate limiter in `rate_limiter.PROVIDER_LIMITS`
+    provider: str = None
+    # `_async_completions` counts the token usage the provider returns; otherwise tokens are estimated
+    reports_usage: bool = False
 
-    def __init__(self, temperature: float = 0.0, max_tokens: int = 2048):
+    def __init__(self, temperature: float = 0.0, max_tokens: int = 2048, hedge: bool = False, call_site: str = "default"):
         self.temperature = temperature
         self.max_tokens = max_tokens
+        # Fire a duplicate request when a call runs past the p95 latency of this model at this call site
+        self.hedge = hedge
+        self.call_site = call_site
         self.default_outputs = "Sorry, I can not satisfy that request."
 
     @abstractmethod
@@ -38,16 +50,31 @@ class LLMAgent(ABC):
     async def _async_completions(self, messages) -> str:
         raise NotImplementedError
     
-    async def _completions_stream(self, messages: List[Dict]) -> str:
+    @abstractmethod
+    async def _completions_stream(self, messages: List[Dict]) -> AsyncIterator[str]:
         raise NotImplementedError
     
-    async def completions_stream(self, messages: List[Dict]) -> str:
+    @property
+    def rate_limiter(self):
+        return get_rate_limiter(self.provider, self.model)
+
+    def _count_tokens(self, kind: str, tokens: float):
+        LLM_TOKENS.labels(provider=self.provider, model=self.model, kind=kind).inc(tokens)
+
+    def _cassette_request(self, messages: List[Dict]) -> Dict:
+        return dict(provider=self.provider, model=self.model, temperature=self.temperature, max_tokens=self.max_tokens, messages=messages)
+
+    async def completions_stream(self, messages: List[Dict]) -> AsyncIterator[str]:
         try:
-            response = self._completions_stream(messages)
-            return response
+            tokens = estimate_tokens(messages, self.max_tokens)
+            self._count_tokens("prompt", estimate_tokens(messages))
+            async for chunk in cassette_stream("llm_stream", self._cassette_request(messages),
+                                               lambda: self.rate_limiter.stream(lambda: self._completions_stream(messages), tokens=tokens)):
+                self._count_tokens("completion", len(chunk) / 4)
+                yield chunk
         except Exception as e:
             print(f"Exception for {self.model}", str(e))
-            return self.default_outputs
+            yield self.default_outputs
     
     def completions(self, messages: List[Dict]) -> str:
         try:
@@ -57,21 +84,54 @@ class LLMAgent(ABC):
             print(f"Exception for {self.model}", str(e))
             return self.default_outputs
     
+    @property
+    def latency_tracker(self):
+        return get_latency_tracker(self.provider, self.model, self.call_site)
+
+    async def _timed_completions(self, messages: List[Dict]) -> str:
+        # Only the provider call: queueing in the limiter and retry backoff would inflate the hedge delay
+        start = monotonic()
+        response = await self._async_completions(messages)
+        self.latency_tracker.record(monotonic() - start)
+        return response
+
+    async def _limited_completions(self, messages: List[Dict]) -> str:
+        # 429s are retried by the rate limiter; here we retry timeouts, dropped connections and 5xx
+        tokens = estimate_tokens(messages, self.max_tokens)
+        response = await cassette_call("llm", self._cassette_request(messages),
+                                       lambda: retry_async(lambda: self.rate_limiter.run(lambda: self._timed_completions(messages), tokens=tokens),
+                                                           retry_on=is_transient_error))
+        if not self.reports_usage:
+            self._count_tokens("prompt", estimate_tokens(messages))
+            self._count_tokens("completion", len(str(response)) / 4)
+        return response
+
     async def async_completions(self, messages: List[Dict]) -> str:
         try:
-            response = await self._async_completions(messages)
+            if self.hedge:
+                # No duplicates while the provider is throttling us: they would only add to the overload
+                delay = None if self.rate_limiter.backing_off else self.latency_tracker.percentile(HEDGE_PERCENTILE)
+                response = await hedged(lambda: self._limited_completions(messages), delay,
+                                        should_hedge=lambda: not self.rate_limiter.backing_off)
+            else:
+                response = await self._limited_completions(messages)
             return response
         except Exception as e:
             print(f"Exception for {self.model}", str(e))
             return self.default_outputs
 
 class OpenAIAgent(LLMAgent):
-    def __init__(self, temperature: float = 0.0, max_tokens: int = 2048, model: str = "gpt-3.5-turbo"):
-        super().__init__(temperature, max_tokens)
+    provider = "openai"
+    reports_usage = True
+
+    def __init__(self, temperature: float = 0.0, max_tokens: int = 2048, model: str = "gpt-3.5-turbo", hedge: bool = False,
+                 call_site: str = "default"):
+        super().__init__(temperature, max_tokens, hedge, call_site)
         self.model = model
         openai_api_key = os.getenv("OPENAI_API_KEY")
         self.client = openai.OpenAI(api_key=openai_api_key)
-        self.async_client = openai.AsyncOpenAI(api_key=openai_api_key)
+        # Rate-limit retries are handled by our shared limiter so it can adapt to 429s
+        self.async_client = openai.AsyncOpenAI(api_key=openai_api_key, max_retries=0)
         self.system = [dict(role='system', content='You are an advanced AI system which has been finetuned to provide calibrated probabilistic forecasts under uncertainty, with your performance evaluated according to the Brier score.')]
 
 
@@ -93,11 +153,14 @@ class OpenAIAgent(LLMAgent):
             temperature=self.temperature,
             max_tokens=self.max_tokens
         )
+        if response.usage is not None:
+            self._count_tokens("prompt", response.usage.prompt_tokens)
+            self._count_tokens("completion", response.usage.completion_tokens)
         return response.choices[0].message.content
     
     async def _completions_stream(self, messages: List):
         # messages = self.system + messages
-        stream = self.client.chat.completions.create(
+        stream = await self.async_client.chat.completions.create(
             model=self.model,
             max_tokens=self.max_tokens,
             temperature=self.temperature,
@@ -105,17 +168,22 @@ class OpenAIAgent(LLMAgent):
             stream=True
         )
 
-        for chunk in stream:
-            if (text := chunk.choices[0].delta.content) is not None:
+        async for chunk in stream:
+            if chunk.choices and (text := chunk.choices[0].delta.content) is not None:
                 yield text
 
 class FireworksAgent(OpenAIAgent):
-    def __init__(self, model: str, temperature: float = 0.0, max_tokens: int = 2048):
-        super().__init__(temperature, max_tokens)
+    provider = "fireworks"
+    reports_usage = False
+
+    def __init__(self, model: str, temperature: float = 0.0, max_tokens: int = 2048, hedge: bool = False,
+                 call_site: str = "default"):
+        super().__init__(temperature, max_tokens, hedge=hedge, call_site=call_site)
         self.model = model
         FIREWORKS_API_KEY = os.getenv("FIREWORKS_API_KEY")
         self.client = Fireworks(api_key=FIREWORKS_API_KEY)
-        self.async_client = AsyncFireworks(api_key=FIREWORKS_API_KEY)
+        # As for OpenAI: 429s must reach our shared limiter instead of being retried inside the SDK
+        self.async_client = AsyncFireworks(api_key=FIREWORKS_API_KEY, max_retries=0)
 
     async def _async_completions(self, messages: List[Dict]) -> str:
         response = await self.async_client.chat.completions.acreate(
@@ -126,26 +194,69 @@ class FireworksAgent(OpenAIAgent):
         )
         return response.choices[0].message.content
 
+    async def _completions_stream(self, messages: List):
+        # AsyncFireworks.acreate returns an async generator when stream=True
+        stream = self.async_client.chat.completions.acreate(
+            model=self.model,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            messages=messages,
+            stream=True
+        )
+
+        async for chunk in stream:
+            if chunk.choices and (text := chunk.choices[0].delta.content) is not None:
+                yield text
+
 class AnthropicAgent(LLMAgent):
-    def __init__(self, temperature: float = 0.0, max_tokens: int = 2048, model: str = "claude-3-haiku"):
-        super().__init__(temperature, max_tokens)
-        self.client = Anthropic(api_key=os.env("ANTHROPIC_API_KEY"))
+    provider = "anthropic"
+    reports_usage = True
+
+    def __init__(self, temperature: float = 0.0, max_tokens: int = 2048, model: str = "claude-3-haiku", hedge: bool = False,
+                 call_site: str = "default"):
+        super().__init__(temperature, max_tokens, hedge, call_site)
+        anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
+        self.client = Anthropic(api_key=anthropic_api_key)
+        self.async_client = AsyncAnthropic(api_key=anthropic_api_key, max_retries=0)
         self.model = model
 
     def _completions(self, messages: List[Dict]) -> str:
         response = self.client.messages.create(
             model=self.model,
-            max_tokens_to_sample=self.max_tokens,
+            max_tokens=self.max_tokens,
             temperature=self.temperature,
             messages=messages
         )
         response = response.content[0].text
         return response
 
+    async def _async_completions(self, messages: List[Dict]) -> str:
+        response = await self.async_client.messages.create(
+            model=self.model,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            messages=messages
+        )
+        self._count_tokens("prompt", response.usage.input_tokens)
+        self._count_tokens("completion", response.usage.output_tokens)
+        return response.content[0].text
+
+    async def _completions_stream(self, messages: List):
+        async with self.async_client.messages.stream(
+            model=self.model,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            messages=messages
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+
 class GeminiAgent(LLMAgent):
+    provider = "gemini"
 
-    def __init__(self, temperature: float = 0.0, max_tokens: int = 2048, model: str = "gemini-1.5-flash"):
-        super().__init__(temperature, max_tokens)
+    def __init__(self, temperature: float = 0.0, max_tokens: int = 2048, model: str = "gemini-1.5-flash", hedge: bool = False,
+                 call_site: str = "default"):
+        super().__init__(temperature, max_tokens, hedge, call_site)
         genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
         self.model=model
         self.client = genai.GenerativeModel(model)
@@ -163,12 +274,9 @@ class GeminiAgent(LLMAgent):
 
     def _preprocess_messages(self, messages: List[Dict]) -> List[Dict]:
         # flatten from {"content": str} to "part": {"text": str}
-        for message in messages:
-            content = message['content']
-            # TODO: support IMAGE here
-            message['parts'] = {"text": content}
-            del message['content']
-        return messages
+        # build new dicts so callers can safely reuse (e.g. retry) their messages
+        # TODO: support IMAGE here
+        return [{"role": message['role'], "parts": {"text": message['content']}} for message in messages]
     
     def _completions(self, messages: List) -> str:
         messages = self._preprocess_messages(messages)
@@ -179,6 +287,14 @@ class GeminiAgent(LLMAgent):
         output = completion.text
 
         return output
+
+    async def _async_completions(self, messages: List) -> str:
+        messages = self._preprocess_messages(messages)
+        inputs = messages.pop()
+        chat = self.client.start_chat(history=messages)
+
+        completion = await chat.send_message_async(inputs['parts'], generation_config=self.generation_config, safety_settings=self.safety_settings)
+        return completion.text
     
     async def _completions_stream(self, messages: List):
         messages = self._preprocess_messages(messages)
@@ -186,6 +302,6 @@ class GeminiAgent(LLMAgent):
         inputs = messages.pop()
         chat = self.client.start_chat(history=messages) 
 
-        response = chat.send_message(inputs['parts'], generation_config=self.generation_config, safety_settings=self.safety_settings, stream=True)
-        for chunk in response:
-            yield chunk.text
\ No newline at end of file
+        response = await chat.send_message_async(inputs['parts'], generation_config=self.generation_config, safety_settings=self.safety_settings, stream=True)
+        async for chunk in response:
+            yield chunk.text
@@ -1,10 +1,12 @@
+from chat_forecasting.domain_matcher import DomainMatcher
+
 def is_news_domains(domain):
-    return any(blacklisted in domain for blacklisted in NEWS_DOMAINS)
+    return domain in NEWS_DOMAIN_MATCHER
 
 NEWS_DOMAINS = [
-    "pbs"
-    "directorsandboards"
-    "thestreet"
+    "pbs",
+    "directorsandboards",
+    "thestreet",
     "crunchbase",
     "dealroom",
     "bloomberg",
@@ -43,4 +45,6 @@ NEWS_DOMAINS = [
     "morningconsult",
     "spf",
     "observer"
-]
\ No newline at end of file
+]
+
+NEWS_DOMAIN_MATCHER = DomainMatcher(NEWS_DOMAINS)
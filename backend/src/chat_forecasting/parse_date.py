@@ -1,60 +1,119 @@
+import os
 import re
-import dateparser
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import parsedate_tz
+from functools import lru_cache
+from typing import Optional
 
 DATE_FORMAT = "%b %d, %Y"
 GOOGLE_SEARCH_DATE_FORMAT = "%Y-%m-%d"
 
 UNKNOWN_TIME = "Unknown"
 
+# Distinct absolute date strings remembered by parse_date (publish dates repeat a lot across sources and runs)
+PARSE_DATE_CACHE_SIZE = int(os.getenv("PARSE_DATE_CACHE_SIZE", 16384))
+
+MONTHS = {month: i + 1 for i, month in enumerate(["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"])}
+MONTH_PATTERN = r'(?:Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|Jun(?:e)?|Jul(?:y)?|Aug(?:ust)?|Sep(?:t(?:ember)?)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)'
+
+# Fast paths, tried in order before dateparser
+ISO_DATE_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})(?:[T ]\d{2}:\d{2}(?::\d{2}(?:[.,]\d+)?)?\s*(?:Z|[+-]\d{2}:?\d{2})?)?$', re.IGNORECASE)
+COMPACT_DATE_RE = re.compile(r'^(\d{4})(\d{2})(\d{2})$')
+EPOCH_RE = re.compile(r'^\d{9,10}(?:\.\d+)?$|^\d{12,13}$')
+RFC_2822_RE = re.compile(r'^(?:[A-Za-z]{3},\s*)?\d{1,2}\s+[A-Za-z]{3}\s+\d{4}\b')
+MONTH_DAY_YEAR_RE = re.compile(rf'^({MONTH_PATTERN})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?,?\s+(\d{{4}})$', re.IGNORECASE)
+DAY_MONTH_YEAR_RE = re.compile(rf'^(\d{{1,2}})(?:st|nd|rd|th)?\s+({MONTH_PATTERN})\.?,?\s+(\d{{4}})$', re.IGNORECASE)
+US_SLASH_DATE_RE = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4})$')
+
+# List of common date meta tags
+DATE_META_TAGS = [
+    'article:published_time',
+    'datePublished',
+    'date',
+    'pubdate',
+    'og:published_time',
+    'publishdate',
+]
+DATE_META_RES = [re.compile(f'<meta[^>]*name="{tag}"[^>]*content="([^"]*)"', re.IGNORECASE) for tag in DATE_META_TAGS]
+# If no meta tag is found, try to find a date in the text
+DATE_TEXT_RES = [
+    re.compile(r'\d{4}-\d{2}-\d{2}'),  # YYYY-MM-DD
+    re.compile(r'\d{2}/\d{2}/\d{4}'),  # MM/DD/YYYY
+    re.compile(rf'\b{MONTH_PATTERN}\s+\d{{1,2}},?\s+\d{{4}}\b'),
+    re.compile(r'<time\s+datetime="([^"]+)"'),  # <time datetime="...">
+    re.compile(r'\d{8}'),  # YYYYMMDD
+]
+
 def extract_date(html: str) -> str:
-    # List of common date meta tags
-    date_meta_tags = [
-        'article:published_time',
-        'datePublished',
-        'date',
-        'pubdate',
-        'og:published_time',
-        'publishdate',
-    ]
-    
-    for tag in date_meta_tags:
-        match = re.search(f'<meta[^>]*name="{tag}"[^>]*content="([^"]*)"', html, re.IGNORECASE)
+    for pattern in DATE_META_RES:
+        match = pattern.search(html)
         if match:
             return parse_date(match.group(1))
-    
-    # If no meta tag is found, try to find a date in the text
-    date_patterns = [
-        r'\d{4}-\d{2}-\d{2}',  # YYYY-MM-DD
-        r'\d{2}/\d{2}/\d{4}',  # MM/DD/YYYY
-        r'\b(?:Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|Jun(?:e)?|Jul(?:y)?|Aug(?:ust)?|Sep(?:tember)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)\s+\d{1,2},?\s+\d{4}\b',
-        r'<time\s+datetime="([^"]+)"',  # <time datetime="...">
-        r'\d{8}',  # YYYYMMDD
-    ]
-    
-    for pattern in date_patterns:
-        match = re.search(pattern, html)
+
+    for pattern in DATE_TEXT_RES:
+        match = pattern.search(html)
         if match:
-            return parse_date(match.group(0))
-    
+            return parse_date(match.group(match.lastindex or 0))
+
     return UNKNOWN_TIME
 
-def parse_date(date_str: str) -> str:
-    # First, try to parse using dateparser
-    parsed_date = dateparser.parse(date_str, settings={'STRICT_PARSING': False})
-    
-    if not parsed_date:
-        # If dateparser fails, try manual parsing for specific formats
-        try:
-            if len(date_str) == 8 and date_str.isdigit():
-                # Handle YYYYMMDD format
-                parsed_date = datetime.strptime(date_str, "%Y%m%d")
-            elif 'T' in date_str:
-                # Handle ISO format with time
-                parsed_date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-        except ValueError:
-            return UNKNOWN_TIME
-    
-    if parsed_date:
-        return parsed_date.strftime(DATE_FORMAT)
-    return UNKNOWN_TIME
\ No newline at end of file
+def _month(name: str) -> int:
+    return MONTHS[name[:3].lower()]
+
+def _fast_parse(date_str: str) -> Optional[datetime]:
+    """Formats publish dates almost always come in; None means "try dateparser"."""
+    match = ISO_DATE_RE.match(date_str) or COMPACT_DATE_RE.match(date_str)
+    if match:
+        return datetime(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    if EPOCH_RE.match(date_str):
+        seconds = float(date_str)
+        # 12-13 digits are milliseconds
+        return datetime.fromtimestamp(seconds / 1000 if seconds > 1e11 else seconds, timezone.utc)
+    match = MONTH_DAY_YEAR_RE.match(date_str)
+    if match:
+        return datetime(int(match.group(3)), _month(match.group(1)), int(match.group(2)))
+    match = DAY_MONTH_YEAR_RE.match(date_str)
+    if match:
+        return datetime(int(match.group(3)), _month(match.group(2)), int(match.group(1)))
+    match = US_SLASH_DATE_RE.match(date_str)
+    if match:
+        return datetime(int(match.group(3)), int(match.group(1)), int(match.group(2)))
+    if RFC_2822_RE.match(date_str):
+        parsed = parsedate_tz(date_str)
+        if parsed:
+            return datetime(*parsed[:3])
+    return None
+
+@lru_cache(maxsize=PARSE_DATE_CACHE_SIZE)
+def _parse_absolute(date_str: str) -> Optional[str]:
+    """The fast paths only: these dates do not depend on when they are parsed, so they are memoized."""
+    try:
+        parsed_date = _fast_parse(date_str)
+    except (ValueError, OverflowError, OSError):
+        # Matched a fast-path shape but is not a real date (e.g. month 13)
+        parsed_date = None
+    return parsed_date.strftime(DATE_FORMAT) if parsed_date else None
+
+def _parse_with_dateparser(date_str: str) -> str:
+    # Last resort; dateparser is slow to import and to run. Not memoized: it also reads
+    # relative dates ("3 hours ago", "yesterday") against the current time.
+    import dateparser
+    try:
+        parsed_date = dateparser.parse(date_str, settings={'STRICT_PARSING': False})
+    except Exception:
+        parsed_date = None
+    return parsed_date.strftime(DATE_FORMAT) if parsed_date else UNKNOWN_TIME
+
+def parse_date(date_str: str, memo: bool = True) -> str:
+    """`date_str` in DATE_FORMAT, or UNKNOWN_TIME; `memo=False` bypasses the memo of absolute dates (benchmarks)."""
+    if not isinstance(date_str, str) or not date_str.strip():
+        return UNKNOWN_TIME
+    date_str = date_str.strip()
+
+    formatted = _parse_absolute(date_str) if memo else _parse_absolute.__wrapped__(date_str)
+    return formatted if formatted is not None else _parse_with_dateparser(date_str)
+
+@lru_cache(maxsize=PARSE_DATE_CACHE_SIZE)
+def date_from_str(date_str: str) -> datetime:
+    """Inverse of the DATE_FORMAT strings returned by parse_date."""
+    return datetime.strptime(date_str, DATE_FORMAT)
@@ -0,0 +1,208 @@
+import os
+import asyncio
+import weakref
+from time import monotonic
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, AsyncIterator
+from chat_forecasting.retry import is_rate_limit_error, backoff_delay
+from dotenv import load_dotenv
+load_dotenv()
+
+# Default quotas per provider; override with e.g. OPENAI_RPM, OPENAI_TPM, OPENAI_MAX_CONCURRENCY.
+# Serper is limited in queries (not tokens or POSTs) per minute: a batched search costs one request per query.
+PROVIDER_LIMITS = {
+    "openai": dict(rpm=5000, tpm=2_000_000, max_concurrency=64),
+    "fireworks": dict(rpm=600, tpm=1_000_000, max_concurrency=32),
+    "anthropic": dict(rpm=1000, tpm=400_000, max_concurrency=32),
+    "gemini": dict(rpm=1000, tpm=1_000_000, max_concurrency=32),
+    "serper": dict(rpm=3000, tpm=None, max_concurrency=16),
+}
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", 5))
+RATE_LIMIT_MAX_BACKOFF = float(os.getenv("RATE_LIMIT_MAX_BACKOFF", 30))
+
+
+def estimate_tokens(messages: List[Dict], max_tokens: int = 0) -> int:
+    # ~4 characters per token; providers count max_tokens against the TPM quota up front
+    return sum(len(str(m.get('content', ''))) for m in messages) // 4 + max_tokens
+
+
+class TokenBucket:
+    """Refills `rate_per_minute` units per minute up to `capacity`; waiters are served in FIFO order."""
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate_per_second = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self._tokens = self.capacity
+        self._updated_at = monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+
+    @property
+    def paused(self) -> bool:
+        return monotonic() < self._paused_until
+
+    async def acquire(self, amount: float = 1):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate_per_second)
+
+
+class AIMDConcurrencyLimiter:
+    """
+    Concurrency limit that grows additively on success (+1 per `limit` successes)
+    and halves on overload, at most once per `cooldown` seconds.
+    """
+    def __init__(self, max_limit: int, min_limit: int = 1, decrease_factor: float = 0.5, cooldown: float = 1.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < max(int(self.limit), self.min_limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    @property
+    def backing_off(self) -> bool:
+        """Still recovering from an overload."""
+        return self.limit < self.max_limit
+
+    def on_overload(self):
+        now = monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+            self._last_decrease = now
+
+
+class ProviderRateLimiter:
+    """Requests/tokens-per-minute buckets plus AIMD concurrency for one provider and model."""
+    def __init__(self, provider: str, model: Optional[str], rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 max_concurrency: Optional[int] = None, max_retries: int = RATE_LIMIT_MAX_RETRIES):
+        self.provider = provider
+        self.model = model
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = AIMDConcurrencyLimiter(max_concurrency or 16)
+        self.max_retries = max_retries
+        self.stats = dict(requests=0, rate_limited=0)
+
+    @asynccontextmanager
+    async def limit(self, tokens: int = 1, requests: int = 1):
+        """`requests` is the call's cost against the rpm quota, e.g. the number of queries in a batched Serper POST."""
+        if self.requests:
+            await self.requests.acquire(requests)
+        if self.tokens:
+            await self.tokens.acquire(tokens)
+        await self.concurrency.acquire()
+        try:
+            self.stats['requests'] += 1
+            yield
+        finally:
+            await self.concurrency.release()
+
+    def on_success(self):
+        self.concurrency.on_success()
+
+    @property
+    def backing_off(self) -> bool:
+        """Recently rate limited: requests are paused or the concurrency limit has not recovered yet."""
+        return self.concurrency.backing_off or (self.requests is not None and self.requests.paused)
+
+    def on_rate_limited(self, e: Exception, attempt: int) -> float:
+        """Back off after a 429 and return how long the caller should wait before retrying."""
+        self.stats['rate_limited'] += 1
+        self.concurrency.on_overload()
+        delay = backoff_delay(attempt, e, max_delay=RATE_LIMIT_MAX_BACKOFF)
+        # Hold every caller of this provider/model, not just this one
+        if self.requests:
+            self.requests.pause(delay)
+        name = f"{self.provider} ({self.model})" if self.model else self.provider
+        print(f"Rate limited by {name}, retrying in {delay:.1f}s (concurrency limit={int(self.concurrency.limit)})")
+        return delay
+
+    async def run(self, call: Callable[[], Awaitable], tokens: int = 1, requests: int = 1):
+        """Run `call()` under the limits, retrying rate-limited attempts after backing off."""
+        for attempt in range(self.max_retries + 1):
+            async with self.limit(tokens, requests):
+                try:
+                    response = await call()
+                    self.on_success()
+                    return response
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt == self.max_retries:
+                        raise
+                    delay = self.on_rate_limited(e, attempt)
+            await asyncio.sleep(delay)
+
+    async def stream(self, stream_factory: Callable[[], AsyncIterator], tokens: int = 1, requests: int = 1) -> AsyncIterator:
+        """Like `run` for streams; holds a concurrency slot for the whole stream and only retries before the first chunk."""
+        for attempt in range(self.max_retries + 1):
+            started = False
+            async with self.limit(tokens, requests):
+                try:
+                    async for chunk in stream_factory():
+                        started = True
+                        yield chunk
+                    self.on_success()
+                    return
+                except Exception as e:
+                    if started or not is_rate_limit_error(e) or attempt == self.max_retries:
+                        raise
+                    delay = self.on_rate_limited(e, attempt)
+            await asyncio.sleep(delay)
+
+
+def _provider_config(provider: str, key: str):
+    value = os.getenv(f"{provider.upper()}_{key.upper()}")
+    if value is not None:
+        return float(value) if value else None
+    return PROVIDER_LIMITS.get(provider, {}).get(key)
+
+# asyncio primitives belong to one event loop, so limiters are kept per loop
+_rate_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = weakref.WeakKeyDictionary()
+
+def get_rate_limiter(provider: str, model: Optional[str] = None) -> ProviderRateLimiter:
+    """
+    Return the limiter shared by every agent of this provider and model in the running event loop.
+    Leave out `model` for account-wide quotas (e.g. Serper, whose news and search endpoints share one).
+    """
+    limiters = _rate_limiters.setdefault(asyncio.get_running_loop(), {})
+    if (provider, model) not in limiters:
+        max_concurrency = _provider_config(provider, "max_concurrency")
+        limiters[(provider, model)] = ProviderRateLimiter(
+            provider,
+            model,
+            rpm=_provider_config(provider, "rpm"),
+            tpm=_provider_config(provider, "tpm"),
+            max_concurrency=int(max_concurrency) if max_concurrency else None,
+        )
+    return limiters[(provider, model)]
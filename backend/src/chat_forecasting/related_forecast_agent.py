@@ -36,10 +36,25 @@ Example Output:
 """
 
     def completion(self, question):
+        _input = self.related_forecast_prompt.format(question=question)
         try:
-            _input = self.related_forecast_prompt.format(question=question)
             response_text = self.generate_related_forecast_agent.completions([{'role': 'user', 'content': _input}])
+        except Exception as e:
+            print(f"Error in RelatedForecastAgent completion: {str(e)}")
+            return []
+        return self._parse_related_forecasts(response_text)
 
+    async def async_completion(self, question):
+        _input = self.related_forecast_prompt.format(question=question)
+        try:
+            response_text = await self.generate_related_forecast_agent.async_completions([{'role': 'user', 'content': _input}])
+        except Exception as e:
+            print(f"Error in RelatedForecastAgent completion: {str(e)}")
+            return []
+        return self._parse_related_forecasts(response_text)
+
+    def _parse_related_forecasts(self, response_text):
+        try:
             json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
             if json_match:
                 json_str = json_match.group()
@@ -1,15 +1,21 @@
-import aiohttp
 import asyncio
 import json
+import os
 from time import time
 from typing import List, Dict, Tuple
-from chat_forecasting.crawl_agent import deduplicate_search_links, fetch_content
+from chat_forecasting.crawl_agent import deduplicate_search_links, fetch_content, new_fetch_stats
 from datetime import datetime
 from typing import Optional
 from chat_forecasting.parse_date import GOOGLE_SEARCH_DATE_FORMAT
-from chat_forecasting.caching_agent import CachingAgent
-import concurrent
+from chat_forecasting.caching_agent import get_caching_agent, SOURCE_PREVIEW_FIELDS, SOURCE_CONTENT_FIELDS, SOURCE_MAX_AGE_DAYS
+from chat_forecasting.search_cache import get_search_cache, search_cache_key
+from chat_forecasting.domain_matcher import DomainMatcher
+from chat_forecasting.http_client import get_http_session
 from chat_forecasting.llm_agent import get_llm_agent_class
+from chat_forecasting.rate_limiter import get_rate_limiter
+from chat_forecasting.retry import parse_retry_after, RateLimitError
+from chat_forecasting.cassette import cassette_call
+from chat_forecasting.telemetry import span, CACHE_LOOKUPS
 import numpy as np
 from urllib.parse import urlparse
 from copy import deepcopy
@@ -18,22 +24,37 @@ from copy import deepcopy
 BLACKLISTED_DOMAINS: List[str] = [
     "youtube.com", ".pdf", "linkedin.com", ".ashx", "facebook.com", "instagram.com"
 ]
+BLACKLISTED_DOMAIN_MATCHER = DomainMatcher(BLACKLISTED_DOMAINS)
 SERPER_SEARCH_TYPE_TO_KEY = {
     'search': 'organic',
     'news': 'news'
 }
+# Base URL of the Serper API (pointed at a local stand-in by benchmarks/load_test.py)
+SERPER_API_URL = os.getenv("SERPER_API_URL", "https://google.serper.dev").rstrip("/")
+# Per-request concurrency of each research pipeline stage
+RESEARCH_FETCH_CONCURRENCY = int(os.getenv("RESEARCH_FETCH_CONCURRENCY", 10))
+RESEARCH_SUMMARIZE_CONCURRENCY = int(os.getenv("RESEARCH_SUMMARIZE_CONCURRENCY", 10))
+# Latency budget of a research call (unset/0 disables) and the sources required before it may return early
+RESEARCH_DEADLINE_MS = int(os.getenv("RESEARCH_DEADLINE_MS") or 0) or None
+RESEARCH_MIN_SOURCES = int(os.getenv("RESEARCH_MIN_SOURCES", 1))
 
 class ResearchAgent:
-    def __init__(self, serper_api_key, search_type: str='search', breadth: int='5', before_timestamp: int = None):
+    def __init__(self, serper_api_key, search_type: str='search', breadth: int='5', before_timestamp: int = None,
+                 research_deadline_ms: int = None, min_sources: int = None):
         self.serper_api_key = serper_api_key
         self.search_type = search_type if search_type else 'search'
         self.search_serper_args = \
-                dict(url = f"https://google.serper.dev/{self.search_type}", \
+                dict(url = f"{SERPER_API_URL}/{self.search_type}", \
                     headers = {'X-API-KEY': self.serper_api_key,'Content-Type': 'application/json'}
                 )
         self.breadth = breadth
+        self.research_deadline_ms = research_deadline_ms or RESEARCH_DEADLINE_MS
+        self.min_sources = min_sources if min_sources is not None else RESEARCH_MIN_SOURCES
+        self.dropped_sources = []
+        self.fetch_stats = new_fetch_stats()
         self.before_date_str, self.before_timestamp = handle_timestamp(before_timestamp)
-        self.summarize_agent = get_llm_agent_class("gpt-4o-mini")(model="gpt-4o-mini", temperature=0.0, max_tokens=512)
+        self.summarize_agent = get_llm_agent_class("gpt-4o-mini")(model="gpt-4o-mini", temperature=0.0, max_tokens=512, hedge=True,
+                                                                  call_site="summarizer")
         self.summarize_prompt = '''I want to make the following article shorter (condense it to no more than 256 words).
 Article: {article}
 When doing this task for me, please do not remove any details that would be helpful for making considerations about the following forecasting question.
@@ -42,31 +63,49 @@ Forecasting Question: {question}
 ---
 Only return the summarized article. Do not answer the forecasting question yourself. No yapping!
 '''
-        self.caching_agent = CachingAgent()
+        self.caching_agent = get_caching_agent()
+        self.search_cache = get_search_cache()
 
     async def search_serper(self, queries: List[str], batch_size: int = 20) -> List[List[str]]:
-        results = []
-        for i in range(0, len(queries), batch_size):
-            batch = queries[i:i+batch_size]
-            payload = json.dumps([{"q": q} for q in batch])
+        search_key = SERPER_SEARCH_TYPE_TO_KEY[self.search_type]
+        keys = [search_cache_key(q, self.search_type, self.before_date_str) for q in queries]
+        searches = await self.search_cache.get_many(keys, self.before_date_str, self.caching_agent)
+
+        # Only send queries that missed both cache tiers to Serper (deduplicated by cache key)
+        missing = [(k, q) for k, q in dict(zip(keys, queries)).items() if k not in searches]
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i:i+batch_size]
+            payload = json.dumps([{"q": q} for _, q in batch])
 
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(**self.search_serper_args, data=payload) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            search_key = SERPER_SEARCH_TYPE_TO_KEY[self.search_type]
-                            processed_data = [self._post_process_search(d[search_key]) for d in data]
-                            results.extend(processed_data)
-                        else:
-                            print("Out of credit: Serper Search status=", response.status)
+                with span("serper_search", queries=len(batch)):
+                    data = await cassette_call("serper", dict(url=self.search_serper_args['url'], payload=payload),
+                                               lambda: get_rate_limiter("serper").run(
+                                                   lambda: self._post_serper(payload), requests=len(batch)))
+                if data is not None:
+                    new_searches = {}
+                    for (key, query), d in zip(batch, data):
+                        searches[key] = d.get(search_key, [])
+                        if searches[key]:
+                            new_searches[key] = dict(query=query, search_type=self.search_type, results=searches[key])
+                    await self.search_cache.set_many(new_searches, self.before_date_str, self.caching_agent)
             except Exception as e:
                 print(f"Error processing batch {i//batch_size + 1}: {str(e)}")
 
-        return results
+        return [self._post_process_search(searches[k]) for k in keys if k in searches]
     
+    async def _post_serper(self, payload: str) -> Optional[List[Dict]]:
+        session = get_http_session()
+        async with session.post(**self.search_serper_args, data=payload) as response:
+            if response.status == 429:
+                raise RateLimitError("Serper Search rate limited", retry_after=parse_retry_after(response.headers.get("Retry-After")))
+            if response.status != 200:
+                print("Out of credit: Serper Search status=", response.status)
+                return None
+            return await response.json()
+
     def _post_process_search(self, search_results):
-        search_results = [s for s in search_results if not any(link_type in s['link'].lower() for link_type in BLACKLISTED_DOMAINS)]    
+        search_results = [s for s in search_results if s['link'] not in BLACKLISTED_DOMAIN_MATCHER]
         return search_results
     
     async def _preprocess_research(self, search_results: List[List[Dict]]):
@@ -98,14 +137,23 @@ Only return the summarized article. Do not answer the forecasting question yours
         filtered_results = [[r for r in results if urlparse(r['link']).netloc.lower() not in blacklist_domains] 
                             for results in search_results]
         
-        # Query for cached (existing) sources
+        # Query for cached (existing) sources: preview fields first, raw content only for unsummarized ones
         try:
-            cached_sources = await self.caching_agent.check_existing_sources([r['link'] for r in np.concatenate(filtered_results)])
-            # Serialize sources:
-            existed_sources = {}
-            for sources in cached_sources:
-                del sources['createdAt'], sources['updatedAt']
-                existed_sources[sources['_id']] = sources
+            max_age_seconds = None if self.before_timestamp else SOURCE_MAX_AGE_DAYS * 24 * 60 * 60
+            cached_sources = await self.caching_agent.check_existing_sources([r['link'] for r in np.concatenate(filtered_results)],
+                                                                             fields=SOURCE_PREVIEW_FIELDS,
+                                                                             max_age_seconds=max_age_seconds)
+            existed_sources = {source.pop('_id'): source for source in cached_sources}
+            unsummarized = [link for link, source in existed_sources.items() if not source.get('summarized_content')]
+            if unsummarized:
+                for source in await self.caching_agent.check_existing_sources(unsummarized, fields=SOURCE_CONTENT_FIELDS):
+                    existed_sources[source.pop('_id')].update(source)
+            # Without content we cannot summarize, so treat those as uncached
+            existed_sources = {link: source for link, source in existed_sources.items()
+                               if source.get('summarized_content') or source.get('raw_content')}
+            links = {r['link'] for results in filtered_results for r in results}
+            CACHE_LOOKUPS.labels(cache="source", result="hit").inc(len(existed_sources))
+            CACHE_LOOKUPS.labels(cache="source", result="miss").inc(len(links) - len(existed_sources))
         except Exception as e:
             print(f"Error checking existing sources: {e}")
             existed_sources = {}
@@ -116,7 +164,8 @@ Only return the summarized article. Do not answer the forecasting question yours
         summarized_content = result.get('summarized_content')
         if not summarized_content: 
             _summarize_input = self.summarize_prompt.format(question=question, article=result["raw_content"])
-            summarized_content = await self.summarize_agent.async_completions([dict(role="user", content=_summarize_input)])
+            with span("summarize", link=result.get('link')):
+                summarized_content = await self.summarize_agent.async_completions([dict(role="user", content=_summarize_input)])
         result['summarized_content'] = summarized_content
         return result
     
@@ -128,71 +177,110 @@ Only return the summarized article. Do not answer the forecasting question yours
         queries = [q + postfix for q in queries][:self.breadth]
 
         # Step 2: Initial Search
-        search_results = await self.search_serper(queries)
-        search_results = deduplicate_search_links(search_results)
+        with span("search", queries=len(queries)):
+            await self.caching_agent.connect()
+            search_results = await self.search_serper(queries)
+            search_results = deduplicate_search_links(search_results)
         timings.append(("Initial Search", time()))
+        stats = self.search_cache.stats
+        print(f"Search cache: memory_hits={stats['memory_hits']} persistent_hits={stats['persistent_hits']} misses={stats['misses']} hit_rate={self.search_cache.hit_rate():.1%}")
                 
         # Step 3: Preprocessing
-        await self.caching_agent.connect()
-        filtered_search_results, blacklist_domains, existed_sources = await self._preprocess_research(search_results)
+        with span("preprocess"):
+            filtered_search_results, blacklist_domains, existed_sources = await self._preprocess_research(search_results)
         timings.append(("Preprocessing", time()))
 
-        # Step 4: Content Fetching (CPU Bounded so we use multi-procs)
-        fetched_sources, failed_domains = [], []
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            loop = asyncio.get_event_loop()
-            tasks = [
-                loop.run_in_executor(
-                    executor,
-                    mult_procs_fetch_content,
-                    fetch_content,
+        # Step 4-6: Pipelined fetching and summarization: each source is handed to the
+        # summarizer as soon as its fetch completes instead of waiting for the slowest domain
+        fetch_semaphore = asyncio.Semaphore(RESEARCH_FETCH_CONCURRENCY)
+        summarize_semaphore = asyncio.Semaphore(RESEARCH_SUMMARIZE_CONCURRENCY)
+
+        async def _fetch(query, result):
+            async with fetch_semaphore:
+                return await fetch_content(
                     query,
                     result,
                     self.before_timestamp,
                     5,  # max_trials
                     1,  # depth
                     2048,  # max_length
-                    existed_sources
+                    existed_sources,
+                    stats=self.fetch_stats,
                 )
-                for query, result in zip(queries, filtered_search_results)
-            ]
-            # fetched_results = await asyncio.gather(*tasks)
-            for i, completed_task in enumerate(asyncio.as_completed(tasks)):
-                _fetched_sources, _failed_domains = await completed_task
-                fetched_sources.extend(_fetched_sources)
-                failed_domains.extend(_failed_domains)
-                
-                # Yield the entire list of fetched sources so far
-                fetched_sources = [source for source in fetched_sources if source]
-                yield fetched_sources
 
-        timings.append(("Content Fetching", time()))
+        async def _summarize(source):
+            async with summarize_semaphore:
+                return await self._summarize_content(source, question)
 
-        # Aggregate fetched contents and failed domains
-        
-        # for _fetched_sources, _failed_domains in fetched_results:
-        #     fetched_sources.extend(_fetched_sources)
-        #     failed_domains.extend(_failed_domains)
-        
-        # Step 6: Summarize sources
-        yield fetched_sources
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.research_deadline_ms / 1000 if self.research_deadline_ms else None
+        fetched_sources, failed_domains, summarized = [], [], set()
+        fetch_tasks = {asyncio.create_task(_fetch(query, result)): query for query, result in zip(queries, filtered_search_results)}
+        summarization_tasks = {}
+        pending = set(fetch_tasks)
+        try:
+            while pending:
+                timeout = None
+                if deadline is not None:
+                    timeout = max(deadline - loop.time(), 0)
+                    # Past the deadline: stop once enough sources are ready, otherwise keep waiting for min_sources
+                    if timeout == 0:
+                        if len(summarized) >= self.min_sources:
+                            break
+                        timeout = None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                fetched_new_sources = False
+                for task in done:
+                    if task in fetch_tasks:
+                        _fetched_sources, _failed_domains = task.result()
+                        failed_domains.extend(_failed_domains)
+                        for source in _fetched_sources:
+                            if source:
+                                fetched_sources.append(source)
+                                summarization_task = asyncio.create_task(_summarize(source))
+                                summarization_tasks[summarization_task] = source
+                                pending.add(summarization_task)
+                        fetched_new_sources = True
+                    else:
+                        summarized.add(id(task.result()))
 
-        summarization_tasks = [self._summarize_content(res, question) for res in fetched_sources if res]
-        processed_sources = await asyncio.gather(*summarization_tasks)
-        timings.append(("Summarize", time()))
+                if fetched_new_sources:
+                    # Yield the entire list of fetched sources so far
+                    yield fetched_sources
+                    if all(task.done() for task in fetch_tasks):
+                        timings.append(("Content Fetching", time()))
+                        yield fetched_sources
+            timings.append(("Summarize", time()))
+
+            # Record the work dropped at the deadline (cancelled in `finally`)
+            self.dropped_sources = [dict(stage="fetch", query=fetch_tasks[task]) for task in pending if task in fetch_tasks]
+            self.dropped_sources += [dict(stage="summarize", query=summarization_tasks[task]['query'], link=summarization_tasks[task]['link'])
+                                     for task in pending if task in summarization_tasks]
+            if self.dropped_sources:
+                print(f"Research deadline of {self.research_deadline_ms}ms reached, dropped {len(self.dropped_sources)} sources:", self.dropped_sources)
+        finally:
+            # Stop in-flight work at the deadline or if the consumer goes away (e.g. client disconnect)
+            for task in list(fetch_tasks) + list(summarization_tasks):
+                task.cancel()
+
+        processed_sources = [source for source in fetched_sources if id(source) in summarized]
 
         # Filter out None results (those that encountered errors during postprocessing)
         results = [result for result in processed_sources if result is not None]
 
         # Step 7: Caching
         caching_new_sources = [s for s in results if s['link'] not in existed_sources]
-        await self.caching_agent.add_sources(caching_new_sources)
-        await self.caching_agent.add_to_blacklist(failed_domains)
+        with span("caching", sources=len(caching_new_sources), failed_domains=len(failed_domains)):
+            await self.caching_agent.add_sources(caching_new_sources)
+            await self.caching_agent.add_to_blacklist(failed_domains)
         # await self.caching_agent.close()
         timings.append(("Caching", time()))
 
         # Print timing breakdown
         print_research_timing(timings)
+        print(f"Cache bytes read: {self.caching_agent.bytes_read}")
+        print("Fetch stats: " + " ".join(f"{k}={v}" for k, v in self.fetch_stats.items()))
 
         yield results
     
@@ -205,12 +293,6 @@ def handle_timestamp(timestamp: Optional[int]) -> Optional[str]:
         timestamp = timestamp // 1000  # Convert milliseconds to seconds
     return datetime.fromtimestamp(timestamp).strftime(GOOGLE_SEARCH_DATE_FORMAT), timestamp
 
-def mult_procs_fetch_content(function, *args, **kwargs):
-    # This method runs in a separate process
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    return loop.run_until_complete(function(*args, **kwargs))
-
 def print_research_timing(timings: List[Tuple[str, float]]):
     """
     Print a detailed breakdown of research timings.
@@ -0,0 +1,137 @@
+import os
+import random
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from dotenv import load_dotenv
+load_dotenv()
+
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", 3))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 1.0))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 30.0))
+# Hedged requests fire a duplicate once a call is slower than this latency percentile
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+
+# Exception class names of the provider SDKs (openai, anthropic, fireworks, google, aiohttp) worth retrying
+TRANSIENT_ERROR_NAMES = {
+    "APIConnectionError", "APITimeoutError", "InternalServerError", "ServiceUnavailableError",
+    "ServiceUnavailable", "DeadlineExceeded",
+    "ServerDisconnectedError", "ServerTimeoutError", "ClientConnectorError", "ClientOSError",
+}
+RATE_LIMIT_ERROR_NAMES = {"RateLimitError", "ResourceExhausted", "TooManyRequests"}
+
+
+class RateLimitError(Exception):
+    """Raised for rate-limited responses that do not come with their own exception (e.g. Serper 429)."""
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _status_code(e: Exception) -> Optional[int]:
+    for attr in ('status_code', 'status', 'code'):
+        status = getattr(e, attr, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+def is_rate_limit_error(e: Exception) -> bool:
+    return isinstance(e, RateLimitError) or _status_code(e) == 429 or type(e).__name__ in RATE_LIMIT_ERROR_NAMES
+
+def is_transient_error(e: Exception) -> bool:
+    """Timeouts, dropped connections and 5xx responses."""
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = _status_code(e)
+    if status is not None and status >= 500:
+        return True
+    return type(e).__name__ in TRANSIENT_ERROR_NAMES
+
+def is_retryable_error(e: Exception) -> bool:
+    return is_rate_limit_error(e) or is_transient_error(e)
+
+def parse_retry_after(value) -> Optional[float]:
+    # Only the delay-seconds form; HTTP-date values fall back to our own backoff
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def get_retry_after(e: Exception) -> Optional[float]:
+    retry_after = getattr(e, 'retry_after', None)
+    if retry_after is None:
+        response = getattr(e, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        retry_after = headers.get('retry-after') or headers.get('Retry-After')
+    return parse_retry_after(retry_after)
+
+def backoff_delay(attempt: int, e: Optional[Exception] = None, base_delay: float = RETRY_BASE_DELAY,
+                  max_delay: float = RETRY_MAX_DELAY) -> float:
+    """Retry-After when the error carries one, otherwise exponential backoff with full jitter."""
+    retry_after = get_retry_after(e) if e is not None else None
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+async def retry_async(call: Callable[[], Awaitable], max_attempts: int = LLM_MAX_ATTEMPTS,
+                      retry_on: Callable[[Exception], bool] = is_retryable_error,
+                      base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY):
+    for attempt in range(max_attempts):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == max_attempts - 1 or not retry_on(e):
+                raise
+            delay = backoff_delay(attempt, e, base_delay, max_delay)
+            print(f"Attempt {attempt + 1} failed: {str(e)}. Retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+
+class LatencyTracker:
+    """Rolling window of call latencies (seconds)."""
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float, min_samples: int = HEDGE_MIN_SAMPLES) -> Optional[float]:
+        if len(self.samples) < min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+_latency_trackers: Dict[Tuple[str, str, str], LatencyTracker] = {}
+
+def get_latency_tracker(provider: str, model: str, call_site: str = "default") -> LatencyTracker:
+    """One window per call site (e.g. planner vs summarizer), whose prompts and outputs differ widely in length."""
+    return _latency_trackers.setdefault((provider, model, call_site), LatencyTracker())
+
+
+async def hedged(call: Callable[[], Awaitable], delay: Optional[float], should_hedge: Optional[Callable[[], bool]] = None):
+    """
+    Run `call()`; if it has not finished after `delay` seconds, start a duplicate
+    and return whichever succeeds first. The other one is cancelled.
+    `should_hedge()` is checked when the delay runs out, e.g. to not add load to a throttling provider.
+    """
+    if delay is None:
+        return await call()
+
+    tasks = {asyncio.create_task(call())}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and (should_hedge is None or should_hedge()):
+            tasks.add(asyncio.create_task(call()))
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
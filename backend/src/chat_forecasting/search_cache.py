@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+from time import monotonic
+from datetime import datetime, timezone
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from chat_forecasting.telemetry import CACHE_LOOKUPS
+from dotenv import load_dotenv
+load_dotenv()
+
+SEARCH_CACHE_MAX_SIZE = int(os.getenv("SEARCH_CACHE_MAX_SIZE", 4096))
+# Seconds a live (no before-date) search stays fresh; before-date searches are historical and never expire
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 6 * 60 * 60))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+def search_cache_key(query: str, search_type: str, before_date_str: Optional[str]) -> str:
+    raw = json.dumps([normalize_query(query), search_type, before_date_str or ""])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def search_cache_ttl(before_date_str: Optional[str]) -> Optional[int]:
+    return None if before_date_str else SEARCH_CACHE_TTL
+
+
+class LRUCache:
+    """In-process LRU cache where each entry may carry its own TTL (seconds)."""
+    def __init__(self, max_size: int = SEARCH_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SearchCache:
+    """
+    Two-tier cache for Serper results: a process-wide LRU in front of the
+    persistent `searches` collection managed by `CachingAgent`.
+    """
+    def __init__(self, max_size: int = SEARCH_CACHE_MAX_SIZE):
+        self.memory = LRUCache(max_size)
+        self.stats = dict(memory_hits=0, persistent_hits=0, misses=0)
+
+    async def get_many(self, keys: List[str], before_date_str: Optional[str], caching_agent=None) -> Dict[str, List[Dict]]:
+        found = {}
+        for key in keys:
+            results = self.memory.get(key)
+            if results is not None:
+                found[key] = results
+        self.stats['memory_hits'] += len(found)
+        CACHE_LOOKUPS.labels(cache="search", result="memory_hit").inc(len(found))
+
+        missing = [k for k in dict.fromkeys(keys) if k not in found]
+        if missing and caching_agent is not None:
+            ttl = search_cache_ttl(before_date_str)
+            persisted = await caching_agent.check_cached_searches(missing, max_age_seconds=ttl)
+            now = datetime.now(timezone.utc)
+            for key, search in persisted.items():
+                # Promoted entries keep what is left of their persisted TTL, not a fresh one
+                remaining = ttl
+                if ttl is not None and search['updatedAt'] is not None:
+                    remaining = ttl - (now - search['updatedAt']).total_seconds()
+                if remaining is None or remaining > 0:
+                    self.memory.set(key, search['results'], ttl=remaining)
+                found[key] = search['results']
+            self.stats['persistent_hits'] += len(persisted)
+            CACHE_LOOKUPS.labels(cache="search", result="persistent_hit").inc(len(persisted))
+
+        misses = len([k for k in missing if k not in found])
+        self.stats['misses'] += misses
+        CACHE_LOOKUPS.labels(cache="search", result="miss").inc(misses)
+        return found
+
+    async def set_many(self, searches: Dict[str, Dict], before_date_str: Optional[str], caching_agent=None):
+        """`searches` maps cache key -> dict(query, search_type, results)."""
+        for key, search in searches.items():
+            self.memory.set(key, search['results'], ttl=search_cache_ttl(before_date_str))
+        if searches and caching_agent is not None:
+            await caching_agent.add_searches(searches, before_date_str)
+
+    def hit_rate(self) -> float:
+        hits = self.stats['memory_hits'] + self.stats['persistent_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else 0.0
+
+
+_search_cache = SearchCache()
+
+def get_search_cache() -> SearchCache:
+    return _search_cache
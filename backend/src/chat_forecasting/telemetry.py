@@ -0,0 +1,134 @@
+import os
+import json
+import uuid
+import asyncio
+import threading
+from itertools import count
+from contextvars import ContextVar
+from time import time, perf_counter
+from typing import Dict, List, Optional
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST as PROMETHEUS_CONTENT_TYPE
+from dotenv import load_dotenv
+load_dotenv()
+
+# Finished traces are appended to this JSONL file (unset disables the export)
+TRACE_FILE = os.getenv("TRACE_FILE")
+# Seconds; covers a cached lookup up to a slow end-to-end forecast
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+# ========================= metrics =========================
+def render_metrics() -> bytes:
+    return generate_latest()
+
+
+SPAN_SECONDS = Histogram("forecasting_span_seconds", "Duration of traced pipeline stages", ["span", "status"], buckets=DEFAULT_BUCKETS)
+REQUESTS_IN_PROGRESS = Gauge("forecasting_requests_in_progress", "Forecasting pipelines currently running")
+PUBLISHER_FIRST_TOKEN_SECONDS = Histogram("forecasting_publisher_first_token_seconds",
+                                          "Time from the publisher call to its first streamed token", ["provider", "model"],
+                                          buckets=DEFAULT_BUCKETS)
+CACHE_LOOKUPS = Counter("forecasting_cache_lookups_total", "Cache lookups by cache (search/source/html_store) and result", ["cache", "result"])
+FETCHES = Counter("forecasting_fetches_total", "Article downloads by outcome (used/rejected/failed/cancelled)", ["outcome"])
+FETCH_FAILURES = Counter("forecasting_fetch_failures_total", "Failed article downloads by registrable domain", ["domain"])
+LLM_TOKENS = Counter("forecasting_llm_tokens_total",
+                     "LLM tokens by provider, model and kind (prompt/completion), as reported by the provider "
+                     "where available, otherwise estimated at ~4 characters per token",
+                     ["provider", "model", "kind"])
+
+
+# ========================= tracing =========================
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_span_ids = count(1)
+_trace_file_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self, root: "Span"):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.root = root
+        self.spans: List["Span"] = []
+
+
+class Span:
+    """
+    A timed stage of a forecasting request, used as `with span("fetch", url=url) as s: ...`.
+
+    Spans nest through a context variable, so spans opened in tasks spawned inside a span
+    (e.g. the per-URL fetches of research) become its children. Every span's duration is
+    observed in `forecasting_span_seconds`; spans inside a `trace(...)` are also collected
+    into that trace, which is written to TRACE_FILE when it ends.
+    """
+    def __init__(self, name: str, attributes: Dict, root: bool = False):
+        self.name = name
+        self.attributes = attributes
+        self.span_id = next(_span_ids)
+        self.parent: Optional[Span] = None
+        self.trace: Optional[Trace] = None
+        self.status = "ok"
+        self.start_time = None
+        self.start = self.end = None
+        self._root = root
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.end - self.start if self.end is not None else None
+
+    def __enter__(self) -> "Span":
+        self.parent = _current_span.get()
+        self.trace = Trace(self) if self._root else (self.parent.trace if self.parent else None)
+        self.start_time, self.start = time(), perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = perf_counter()
+        if exc_type is not None:
+            # GeneratorExit: the streaming client went away
+            if issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+                self.status = "cancelled"
+            else:
+                self.status = "error"
+                self.attributes['error'] = f"{exc_type.__name__}: {exc}"
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Exited in another context than it was entered in (e.g. an async generator closed elsewhere)
+            _current_span.set(self.parent)
+        SPAN_SECONDS.labels(span=self.name, status=self.status).observe(self.duration)
+        if self.trace is not None:
+            self.trace.spans.append(self)
+            if self.trace.root is self and TRACE_FILE:
+                _finish_trace(self.trace)
+        return False
+
+    def to_dict(self, trace_start: float) -> Dict:
+        return dict(name=self.name, span_id=self.span_id, parent_id=self.parent.span_id if self.parent else None,
+                    offset=round(self.start - trace_start, 6), duration=round(self.duration, 6),
+                    status=self.status, attributes=self.attributes)
+
+
+def span(name: str, **attributes) -> Span:
+    """A child of the current span (if any)."""
+    return Span(name, attributes)
+
+def trace(name: str, **attributes) -> Span:
+    """The root span of a new trace, e.g. one forecasting request."""
+    return Span(name, attributes, root=True)
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def _finish_trace(trace: Trace):
+    root = trace.root
+    record = dict(trace_id=trace.trace_id, name=root.name, start_time=root.start_time, duration=round(root.duration, 6),
+                  status=root.status, attributes=root.attributes,
+                  spans=[s.to_dict(root.start) for s in sorted(trace.spans, key=lambda s: s.start)])
+    try:
+        with _trace_file_lock, open(TRACE_FILE, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+    except Exception as e:
+        print(f"Error writing trace to {TRACE_FILE}: {e}")
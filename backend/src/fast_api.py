@@ -1,12 +1,16 @@
-from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
 from typing import List, Dict
 from chat_forecasting import ForecastingMultiAgents
+from chat_forecasting.fetch_pool import start_fetch_pool, shutdown_fetch_pool
+from chat_forecasting.http_client import get_http_session, close_http_session
+from chat_forecasting.caching_agent import CachingAgent, get_caching_agent
+from chat_forecasting.telemetry import render_metrics, PROMETHEUS_CONTENT_TYPE
 import uvicorn
-import ray
-from tqdm import tqdm
-from utils import process_request
+import asyncio
+from utils import forecasting_search_batch, forecasting_search_batch_ndjson, forecasting_search_batch_ray, BATCH_BACKEND
+from batch_jobs import BatchJob, start_batch_job, cancel_running_jobs
 from time import time
 from contextlib import asynccontextmanager
 import os
@@ -24,6 +28,8 @@ class ForecastingData(BaseModel):
     publisherPrompt: str = None
     search_type: str = None
     beforeTimestamp: int = None
+    researchDeadlineMs: int = None
+    minSources: int = None
 
 class BatchForecastingData(BaseModel):
     questions: List[Dict]
@@ -32,17 +38,35 @@ class BatchForecastingData(BaseModel):
     plannerPrompt: str = None
     publisherPrompt: str = None
     search_type: str = None
+    researchDeadlineMs: int = None
+    minSources: int = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Initialize Ray when the app starts
-    env_vars = {k: str(v) for k, v in os.environ.items()}
-    env_vars['RAY_DEDUP_LOGS'] = "0"
-    ray.init(runtime_env={"env_vars": env_vars})
+    # Initialize Ray when the app starts (only used by the optional ray batch backend)
+    if BATCH_BACKEND == "ray":
+        import ray
+        env_vars = {k: str(v) for k, v in os.environ.items()}
+        env_vars['RAY_DEDUP_LOGS'] = "0"
+        ray.init(runtime_env={"env_vars": env_vars})
+    # Warm the shared fetch worker pool once for all requests (spawning the workers blocks, keep it off the loop)
+    await asyncio.to_thread(start_fetch_pool)
+    # Open the shared keep-alive HTTP session used by Serper search and article downloads
+    get_http_session()
+    # Load the domain blacklist into memory so requests skip the Mongo round trip
+    await get_caching_agent().start_blacklist_index()
+    # Cache writes are applied in the background, off the response path
+    await get_caching_agent().start_write_behind()
     yield
+    await cancel_running_jobs()
+    await CachingAgent.stop_blacklist_index()
+    await CachingAgent.stop_write_behind()
+    await close_http_session()
+    shutdown_fetch_pool()
     # Shutdown Ray when the app stops
-    ray.shutdown()
+    if BATCH_BACKEND == "ray":
+        ray.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -56,7 +80,9 @@ async def forecasting_search_endpoint(data: ForecastingData):
                                           data.plannerPrompt,
                                           data.publisherPrompt, 
                                           data.search_type, 
-                                          data.beforeTimestamp)
+                                          data.beforeTimestamp,
+                                          research_deadline_ms=data.researchDeadlineMs,
+                                          min_sources=data.minSources)
     
     response = multi_agents.completions(data.messages)
     return StreamingResponse(response, media_type='text/plain')
@@ -67,32 +93,82 @@ async def forecasting_search_endpoint(data: ForecastingData):
 async def forecasting_search_batch_endpoint(data: BatchForecastingData, parallel: int = 20):
     data.search_type = "news"
     t0 = time()
-    futures = [process_request.options(num_cpus=0.10).remote(q, 
-                                      model=data.model, 
-                                      breadth=data.breadth, 
-                                      planner_prompt=data.plannerPrompt,
-                                      publisher_prompt=data.publisherPrompt,
-                                      search_type=data.search_type)
-               for q in data.questions]
-
-    results = []
-    for i in tqdm(range(len(futures)), desc="Processing"):
-        done, futures = ray.wait(futures)
-        results.extend(ray.get(done))
-    
-        resources = ray.available_resources()
-        total_cpus = ray.cluster_resources()['CPU']
-        used_cpus = total_cpus - resources.get('CPU', 0)
-        
-        print(f"{i+1}. Total CPUs: {total_cpus}", f"| Used CPUs: {used_cpus}", f"| CPU Usage: {used_cpus / total_cpus * 100:.2f}%")
-        print("---")
-
-    ray.shutdown()
+    kwargs = dict(model=data.model, 
+                  breadth=data.breadth, 
+                  planner_prompt=data.plannerPrompt,
+                  publisher_prompt=data.publisherPrompt,
+                  search_type=data.search_type,
+                  research_deadline_ms=data.researchDeadlineMs,
+                  min_sources=data.minSources)
+
+    if BATCH_BACKEND == "ray":
+        # ray.wait blocks, keep it off the event loop
+        results = await asyncio.to_thread(forecasting_search_batch_ray, data.questions, parallel, num_cpus=0.10, **kwargs)
+    else:
+        results = await forecasting_search_batch(data.questions, parallel, **kwargs)
+
     t1 = time()
     print("Total forecasting_search_batch_endpoint time:", t1-t0,"s")
     return results
 
 
+@app.post("/forecasting_search_batch_stream/")
+async def forecasting_search_batch_stream_endpoint(data: BatchForecastingData, parallel: int = 20):
+    # One NDJSON line ({"index", "elapsed", "result"}) per question, in completion order
+    data.search_type = "news"
+    response = forecasting_search_batch_ndjson(data.questions, 
+                                               parallel, 
+                                               model=data.model, 
+                                               breadth=data.breadth, 
+                                               planner_prompt=data.plannerPrompt,
+                                               publisher_prompt=data.publisherPrompt,
+                                               search_type=data.search_type,
+                                               research_deadline_ms=data.researchDeadlineMs,
+                                               min_sources=data.minSources)
+    return StreamingResponse(response, media_type='application/x-ndjson')
+
+
+@app.post("/forecasting_batch_jobs/")
+async def create_batch_job_endpoint(data: BatchForecastingData, parallel: int = 20):
+    # Checkpointed batch: every finished question is persisted, see batch_jobs.BatchJob
+    settings = dict(model=data.model, 
+                    breadth=data.breadth, 
+                    planner_prompt=data.plannerPrompt,
+                    publisher_prompt=data.publisherPrompt,
+                    search_type="news",
+                    research_deadline_ms=data.researchDeadlineMs,
+                    min_sources=data.minSources)
+    job = BatchJob.create(data.questions, settings)
+    return start_batch_job(job, parallel)
+
+
+def _load_batch_job(job_id: str) -> BatchJob:
+    job = BatchJob.load(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Batch job {job_id} not found")
+    return job
+
+@app.get("/forecasting_batch_jobs/{job_id}")
+async def batch_job_status_endpoint(job_id: str):
+    return _load_batch_job(job_id).status()
+
+@app.post("/forecasting_batch_jobs/{job_id}/resume")
+async def resume_batch_job_endpoint(job_id: str, parallel: int = 20):
+    # Only questions without a checkpointed result are run again
+    return start_batch_job(_load_batch_job(job_id), parallel)
+
+@app.get("/forecasting_batch_jobs/{job_id}/results")
+async def batch_job_results_endpoint(job_id: str):
+    job = _load_batch_job(job_id)
+    return dict(**job.status(), results=job.results())
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # Prometheus scrape target: stage latency histograms, cache hit/miss, fetch failures by domain, LLM tokens
+    return Response(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 async def forecasting_search_local(data: dict) -> str:
     model = data['model']
     messages = data['messages']
@@ -102,6 +178,8 @@ async def forecasting_search_local(data: dict) -> str:
     publisherPrompt = data.get('publisherPrompt')
     search_type = data.get('search_type')
     before_timestamp = data.get('beforeTimestamp')
+    research_deadline_ms = data.get('researchDeadlineMs')
+    min_sources = data.get('minSources')
 
     
     multi_agents = ForecastingMultiAgents(model, 
@@ -110,7 +188,9 @@ async def forecasting_search_local(data: dict) -> str:
                                           publisherPrompt, 
                                           search_type, 
                                           before_timestamp,
-                                          factorized_prompt)
+                                          factorized_prompt,
+                                          research_deadline_ms,
+                                          min_sources)
 
     response = multi_agents.completions(messages)
     
@@ -1,10 +1,22 @@
 import asyncio
-from typing import List, Dict
-import ray
+import os
+from typing import List, Dict, Optional, AsyncIterator, Tuple
+from itertools import islice
+from time import time
 from chat_forecasting import ForecastingMultiAgents
+from chat_forecasting.retry import backoff_delay, is_retryable_error, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+from chat_forecasting.http_client import close_http_session
 from functools import wraps
+from tqdm import tqdm
 import re
 import json
+from dotenv import load_dotenv
+load_dotenv()
+
+# "asyncio" runs batches in-process; "ray" fans questions out to ray workers
+BATCH_BACKEND = os.getenv("BATCH_BACKEND", "asyncio")
+# Cap on ForecastingMultiAgents pipelines running at once in this process, across all batches
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 200))
 
 def extract_prediction(prediction_str):
     # Find the first number (integer or float) in the string
@@ -13,22 +25,27 @@ def extract_prediction(prediction_str):
         return float(match.group(1))
     return None
 
-def retry(times=3, exceptions=(Exception,)):
+def retry(times=3, exceptions=(Exception,), retry_on=None, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """
+    Retry an async function up to `times` attempts with exponential backoff and jitter
+    (or the error's Retry-After). `retry_on` further restricts which `exceptions` are retried.
+    """
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
             for attempt in range(times):
-                return await func(*args, **kwargs)
-                # try:
-                #     return await func(*args, **kwargs)
-                # except exceptions as e:
-                #     if attempt == times - 1:  # Last attempt
-                #         raise
-                #     print(f"Attempt {attempt + 1} failed: {str(e)}. Retrying...")
+                try:
+                    return await func(*args, **kwargs)
+                except exceptions as e:
+                    if attempt == times - 1 or (retry_on is not None and not retry_on(e)):
+                        raise
+                    delay = backoff_delay(attempt, e, base_delay, max_delay)
+                    print(f"Attempt {attempt + 1} failed: {str(e)}. Retrying in {delay:.1f}s...")
+                    await asyncio.sleep(delay)
         return wrapper
     return decorator
 
-@retry(times=3)
+@retry(times=3, retry_on=is_retryable_error)
 async def forecasting_search_local_with_retry(messages: List[Dict], **kwargs):
     multi_agents = ForecastingMultiAgents(**kwargs)
     response = multi_agents.completions(messages)
@@ -47,7 +64,8 @@ def process_forecasting(full_result: str):
         sources = [s.strip() for s in sources.split("[SEP_SOURCE]") if s.strip()][-1] if sources else "[]"
         sources = json.loads(sources)
         for source in sources:
-            del source['raw_content']
+            # Cached sources are read without raw_content
+            source.pop('raw_content', None)
 
         response = response.replace("[FORECASTING_END]", "")
 
@@ -62,33 +80,133 @@ def process_forecasting(full_result: str):
         print(e)
         return dict(prediction=None, response=response)
 
-@ray.remote
-def process_request(example: Dict, 
-                    model: str, 
-                    breadth: int,
-                    planner_prompt: str,
-                    publisher_prompt: str,
-                    search_type: str="news",
-                    ):
+def build_request_input(example: Dict,
+                        model: str,
+                        breadth: int,
+                        planner_prompt: str,
+                        publisher_prompt: str,
+                        search_type: str="news",
+                        research_deadline_ms: int=None,
+                        min_sources: int=None,
+                        ) -> Dict:
+    question = example['question']
+    before_timestamp = example.get('beforeTimeStamp')
+    
+    if example.get("backgroundText"):
+        question = f"{question}\n\nBackground text:{example['backgroundText']}"
+    return {
+        "messages": [{"role": "user", "content": question}],
+        "model": model,
+        "breadth": breadth,
+        "planner_prompt": planner_prompt,
+        "publisher_prompt": publisher_prompt,
+        "before_timestamp": before_timestamp,
+        "search_type": search_type,
+        "research_deadline_ms": research_deadline_ms,
+        "min_sources": min_sources,
+    }
+
+async def _forecasting_search_own_loop(**input_data) -> str:
+    # The HTTP session opened on this short-lived loop must be closed before the loop ends
+    try:
+        return await forecasting_search_local_with_retry(**input_data)
+    finally:
+        await close_http_session()
+
+def process_request(example: Dict, **kwargs):
+    # Synchronous entrypoint for the ray backend: one event loop per question
     response = {}
     try:
-        question = example['question']
-        before_timestamp = example.get('beforeTimeStamp')
-        
-        if example.get("backgroundText"):
-            question = f"{question}\n\nBackground text:{example['backgroundText']}"
-        input_data = {
-            "messages": [{"role": "user", "content": question}],
-            "model": model,
-            "breadth": breadth,
-            "planner_prompt": planner_prompt,
-            "publisher_prompt": publisher_prompt,
-            "before_timestamp": before_timestamp,
-            "search_type": search_type,
-        }
-        result = asyncio.run(forecasting_search_local_with_retry(**input_data))
+        input_data = build_request_input(example, **kwargs)
+        result = asyncio.run(_forecasting_search_own_loop(**input_data))
         response = process_forecasting(result)
     except Exception as e:
         print(e)
     finally:
-        return {**example, **response}
\ No newline at end of file
+        return {**example, **response}
+
+# ========================= asyncio batch engine =========================
+_batch_semaphore: Optional[asyncio.Semaphore] = None
+
+def get_batch_semaphore() -> asyncio.Semaphore:
+    global _batch_semaphore
+    if _batch_semaphore is None:
+        _batch_semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    return _batch_semaphore
+
+async def process_request_async(example: Dict, **kwargs):
+    response = {}
+    try:
+        input_data = build_request_input(example, **kwargs)
+        async with get_batch_semaphore():
+            result = await forecasting_search_local_with_retry(**input_data)
+        response = process_forecasting(result)
+    except Exception as e:
+        print(e)
+    finally:
+        return {**example, **response}
+
+async def iter_forecasting_batch(questions: List[Dict], parallel: int = 20, **kwargs) -> AsyncIterator[Tuple[int, Dict, float]]:
+    """
+    Run a batch of questions concurrently in this process and yield `(index, result, elapsed_seconds)`
+    as each question completes.
+
+    At most `parallel` questions of this batch are in flight, so memory does not grow with the batch size;
+    the process-wide BATCH_MAX_CONCURRENCY semaphore caps all batches together.
+    """
+    async def _run(i, example):
+        start = time()
+        result = await process_request_async(example, **kwargs)
+        return i, result, time() - start
+
+    questions = iter(enumerate(questions))
+    pending = set()
+
+    def _schedule():
+        for i, example in islice(questions, max(parallel - len(pending), 0)):
+            pending.add(asyncio.create_task(_run(i, example)))
+
+    _schedule()
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+            _schedule()
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def forecasting_search_batch(questions: List[Dict], parallel: int = 20, **kwargs) -> List[Dict]:
+    results = [None] * len(questions)
+    with tqdm(total=len(questions), desc="Processing") as progress:
+        async for i, result, _ in iter_forecasting_batch(questions, parallel, **kwargs):
+            results[i] = result
+            progress.update(1)
+    return results
+
+async def forecasting_search_batch_ndjson(questions: List[Dict], parallel: int = 20, **kwargs) -> AsyncIterator[str]:
+    """Stream one NDJSON line per question as soon as it completes."""
+    async for i, result, elapsed in iter_forecasting_batch(questions, parallel, **kwargs):
+        yield json.dumps(dict(index=i, elapsed=round(elapsed, 3), result=result), default=str) + "\n"
+
+# ========================= ray batch backend (optional) =========================
+def forecasting_search_batch_ray(questions: List[Dict], parallel: int = 20, num_cpus: float = 0.25, **kwargs) -> List[Dict]:
+    import ray
+
+    if not ray.is_initialized():
+        env_vars = {k: str(v) for k, v in os.environ.items()}
+        env_vars['RAY_DEDUP_LOGS'] = "0"
+        ray.init(num_cpus=parallel, runtime_env={"env_vars": env_vars})
+
+    remote_process_request = ray.remote(process_request)
+    futures = [remote_process_request.options(num_cpus=num_cpus).remote(q, **kwargs) for q in questions]
+    # Keep results in question order, like the asyncio engine
+    order = {future: i for i, future in enumerate(futures)}
+
+    results = [None] * len(futures)
+    for _ in tqdm(range(len(futures)), desc="Processing"):
+        done, futures = ray.wait(futures)
+        for future in done:
+            results[order[future]] = ray.get(future)
+    return results